@@ -0,0 +1,70 @@
+import json
+import os
+
+# 应用配置文件，与本文件位于同一目录
+APP_CONFIG_NAME = "sam_config.json"
+# 模型文件名关键字与配置文件的对应关系，按顺序匹配
+CONFIG_BY_KEYWORD = [
+    ("large", "sam2_hiera_l.yaml"),
+    ("base", "sam2_hiera_b+.yaml"),
+    ("small", "sam2_hiera_s.yaml"),
+    ("tiny", "sam2_hiera_t.yaml"),
+]
+# 未识别模型类型时默认使用large配置
+DEFAULT_CONFIG = "sam2_hiera_l.yaml"
+# 默认分块参数：分块边长、相邻分块的重叠宽度、每个分块内网格提示点的每边数量
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+POINTS_PER_SIDE = 16
+
+
+def load_app_config(path=None):
+    """读取应用配置，不存在或损坏时返回空字典
+
+    支持的字段：
+      default_checkpoint:   启动时自动加载的模型文件
+      config:               该模型的配置文件（默认根据模型文件名自动选择）
+      device:               运行设备，例如 cpu 或 cuda（默认自动选择）
+      warmup:               加载后是否预热一次推理（默认 true）
+      model_memory_mb:      常驻内存的模型总大小上限
+      cpu_profile:          CPU 上的推理配置，default、fast 或 int8（见 benchmarks/bench_cpu_profile.py）
+      num_threads:          CPU 推理使用的线程数（默认由 PyTorch 决定）
+      results_cache_mb:     分割结果缓存（候选掩码、得分、logits）的内存上限
+      annotation_memory_mb: 标注在内存中的上限，超出后写入磁盘临时目录
+      feature_store:        编码特征的保存目录（默认为图片目录下的 .sam2_features），false 表示不保存
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), APP_CONFIG_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def resolve_config_path(checkpoint_path, project_root=None):
+    """根据模型文件名确定配置文件路径，返回 (配置文件路径, 是否识别出模型类型)"""
+    if project_root is None:
+        # 默认与本文件位于同一目录（SAM2主目录）
+        project_root = os.path.dirname(os.path.abspath(__file__))
+
+    checkpoint_name = os.path.basename(checkpoint_path)
+    config_filename, recognized = DEFAULT_CONFIG, False
+    for keyword, filename in CONFIG_BY_KEYWORD:
+        if keyword in checkpoint_name:
+            config_filename, recognized = filename, True
+            break
+
+    # 构建配置文件的可能路径
+    config_path = os.path.join(project_root, "sam2", "configs", "sam2", config_filename)
+    # 如果第一个路径不存在，尝试直接在sam2目录下查找
+    if not os.path.exists(config_path):
+        config_path = os.path.join(project_root, "sam2", config_filename)
+    return config_path, recognized
+
+
+def memory_bytes(config, key, default):
+    """读取以 MB 为单位的内存上限，未设置时返回 default（字节）"""
+    value = config.get(key)
+    return int(value * 1024 ** 2) if value else default
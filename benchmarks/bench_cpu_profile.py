@@ -0,0 +1,92 @@
+"""CPU 推理配置基准：对比 default、fast、int8 配置（以及不同线程数）的编码/解码延迟
+
+python benchmarks/bench_cpu_profile.py --checkpoint sam2_hiera_large.pt --image test.jpg --threads 4,8
+
+结果用于选择 sam_config.json 中的 cpu_profile 和 num_threads。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_cache import apply_features, encode_image
+from sam_model import CPU_PROFILES, apply_cpu_profile, inference_context, load_predictor, resolve_config_path, warm_up
+from sam_quantize import load_int8_predictor
+
+
+def timed(func, repeat):
+    """返回多次运行中最快一次的耗时（毫秒）和最后一次的结果"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def mask_iou(a, b):
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+def run_profile(args, config_path, image, profile, num_threads):
+    if profile == "int8":
+        # 第一次运行时量化、校验并缓存，校验未通过时得到的是浮点模型
+        model, predictor = load_int8_predictor(args.checkpoint, config_path)
+        profile = predictor.cpu_profile
+    else:
+        model, predictor = load_predictor(args.checkpoint, config_path, "cpu")
+    apply_cpu_profile(model, predictor, profile, num_threads)
+    warm_up(predictor)
+
+    encode_ms, features = timed(lambda: encode_image(predictor, image), args.repeat)
+    apply_features(predictor, features)
+    h, w = image.shape[:2]
+    point = np.array([[w / 2, h / 2]])
+
+    def decode():
+        with inference_context(predictor):
+            return predictor.predict(point_coords=point, point_labels=np.array([1]), multimask_output=True)
+
+    decode_ms, (masks, scores, _) = timed(decode, args.repeat * 5)
+    return encode_ms, decode_ms, masks[np.argmax(scores)] > 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU 推理配置基准")
+    parser.add_argument("--checkpoint", required=True, help="模型文件(.pt)")
+    parser.add_argument("--config", help="模型配置文件，默认根据模型文件名自动选择")
+    parser.add_argument("--image", help="测试图片，默认使用随机图片")
+    parser.add_argument("--threads", default="", help="逗号分隔的线程数列表，默认只测试 PyTorch 默认线程数")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    config_path = args.config or resolve_config_path(args.checkpoint)[0]
+    if args.image:
+        image = np.array(Image.open(args.image).convert("RGB"))
+    else:
+        image = np.random.default_rng(0).integers(0, 256, (768, 1024, 3), dtype=np.uint8)
+    thread_counts = [int(t) for t in args.threads.split(",") if t.strip()] or [None]
+    default_threads = torch.get_num_threads()
+
+    print(f"{'配置':<10}{'线程':>6}{'编码(ms)':>12}{'解码(ms)':>12}{'编码加速':>10}{'解码加速':>10}{'掩码IoU':>10}")
+    baseline = None
+    for num_threads in thread_counts:
+        for profile in CPU_PROFILES:
+            encode_ms, decode_ms, mask = run_profile(args, config_path, image, profile, num_threads)
+            if baseline is None:
+                # 第一行（default 配置）作为对比基准
+                baseline = (encode_ms, decode_ms, mask)
+            print(f"{profile:<10}{num_threads or default_threads:>6}{encode_ms:>12.1f}{decode_ms:>12.1f}"
+                  f"{baseline[0] / encode_ms:>10.2f}{baseline[1] / decode_ms:>10.2f}{mask_iou(baseline[2], mask):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
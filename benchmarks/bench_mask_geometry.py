@@ -0,0 +1,79 @@
+"""掩码几何计算的微基准：4K 掩码上对比 np.where 坐标数组与归约/图像矩的实现
+
+python benchmarks/bench_mask_geometry.py --repeat 20
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mask_geometry import blend_mask, bounding_box, centroid
+from mask_utils import CompactMask
+
+
+def make_mask(height, width, fill):
+    """生成一个占整图 fill 比例的椭圆目标"""
+    mask = np.zeros((height, width), dtype=np.uint8)
+    axes = (int(width * fill ** 0.5 / 2), int(height * fill ** 0.5 / 2))
+    cv2.ellipse(mask, (width // 2, height // 2), axes, 0, 0, 360, 1, -1)
+    return mask.astype(bool)
+
+
+def where_bbox(mask):
+    coords = np.column_stack(np.where(mask > 0.5))
+    y_min, x_min = coords.min(axis=0)
+    y_max, x_max = coords.max(axis=0)
+    return (int(x_min), int(y_min), int(x_max) + 1, int(y_max) + 1)
+
+
+def where_centroid(mask):
+    coords = np.column_stack(np.where(mask))
+    center = coords.mean(axis=0).astype(int)
+    return (int(center[1]), int(center[0]))
+
+
+def full_blend(image, mask, color, alpha):
+    h, w = mask.shape
+    mask_image = (mask.reshape(h, w, 1) * color.reshape(1, 1, -1) * 255).astype(np.uint8)
+    return cv2.addWeighted(image, 1, mask_image, alpha, 0)
+
+
+def bench(name, old, new, repeat):
+    old_time = min(timeit.repeat(old, number=1, repeat=repeat)) * 1000
+    new_time = min(timeit.repeat(new, number=1, repeat=repeat)) * 1000
+    print(f"{name:<24} np.where/整幅 {old_time:8.2f} ms   新实现 {new_time:8.2f} ms   加速 {old_time / new_time:6.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="掩码几何计算微基准")
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--fill", type=float, default=0.05, help="目标面积占整图的比例")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    mask = make_mask(args.height, args.width, args.fill)
+    compact = CompactMask.from_dense(mask)
+    assert where_bbox(mask) == bounding_box(mask)
+    assert where_centroid(mask) == centroid(mask)
+    image = np.full((args.height, args.width, 3), 128, dtype=np.uint8)
+    color = np.array([30 / 255, 144 / 255, 255 / 255])
+    print(f"掩码 {args.width}x{args.height}，目标占比 {args.fill:.0%}")
+
+    bench("外接框", lambda: where_bbox(mask), lambda: bounding_box(mask), args.repeat)
+    bench("中心点（整图）", lambda: where_centroid(mask), lambda: centroid(mask), args.repeat)
+    # 标注保存为紧凑掩码，中心点只在外接框内计算（之后由 CompactMask.centroid 缓存）
+    bench("中心点（紧凑掩码）", lambda: where_centroid(mask),
+          lambda: centroid(compact.crop(), compact.bbox[:2]), args.repeat)
+    view = mask.astype(np.uint8)
+    bench("视图叠加", lambda: full_blend(image, view, color, 0.5),
+          lambda: blend_mask(image.copy(), view, color, 0.5), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""启动耗时基准：在新进程中测量导入 sam、crop 的耗时，以及导入后已加载的重量级模块
+
+python benchmarks/bench_startup.py --repeat 5
+
+torch、matplotlib、sam2 应在打开窗口之后才导入（sam 在后台线程中预先导入 torch 和 sam2），
+导入耗时可以用 python -X importtime -c "import sam" 进一步细分。
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "matplotlib", "sam2")
+
+# 子进程中执行：导入模块并输出耗时与已加载的重量级模块
+_IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+# 子进程中执行：创建主窗口并处理第一轮事件，没有显示环境时输出 skip
+_WINDOW_SCRIPT = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+import sam
+try:
+    root = tk.Tk()
+except tk.TclError:
+    print("skip")
+else:
+    app = sam.SAMInteractiveApp(root)
+    root.update()
+    print(time.perf_counter() - start)
+    root.destroy()
+"""
+
+
+def run_python(script):
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return result.stdout.splitlines()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="启动耗时基准")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'模块':<10}{'导入(ms)':>12}  已加载的重量级模块")
+    for module in ("sam", "crop"):
+        best = float("inf")
+        loaded = ""
+        for _ in range(args.repeat):
+            elapsed, loaded = run_python(_IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES))[-2:]
+            best = min(best, float(elapsed))
+        print(f"{module:<10}{best * 1000:>12.1f}  {loaded or '无'}")
+
+    lines = run_python(_WINDOW_SCRIPT)
+    if lines[-1] == "skip":
+        print("没有显示环境，跳过窗口创建耗时")
+    else:
+        print(f"导入 sam 并显示主窗口: {float(lines[-1]) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2
+from PIL import Image
+
+from mask_utils import CompactMask
+from palette import generate_colors
+from yolo_io import image_size, mask_to_yolo_line, write_label_file, write_text_atomic
+
+# 导出目录中记录每张图片导出内容哈希的清单文件
+MANIFEST_NAME = "export_manifest.json"
+
+
+def render_preview(image_path, masks):
+    """把所有掩码半透明叠加到原图上，返回RGB数组"""
+    result_img = np.array(Image.open(image_path).convert("RGB"))
+    colors = generate_colors(len(masks))
+    for mask, color in zip(masks, colors):
+        if not isinstance(mask, CompactMask):
+            mask = CompactMask.from_dense(mask)
+        if mask.bbox is None:
+            continue
+        # 掩码外的像素叠加的是0，只需在外接框内混合，结果与整图 addWeighted 一致
+        x0, y0, x1, y1 = mask.bbox
+        crop = mask.crop().astype(np.uint8)
+        mask_image = (crop[:, :, None] * color.reshape(1, 1, -1) * 255).astype(np.uint8)
+        region = result_img[y0:y1, x0:x1]
+        region[:] = cv2.addWeighted(region, 1, mask_image, 0.5, 0)
+    return result_img
+
+
+def export_image(image_path, annotations, save_dir, dataset_type, write_preview=True):
+    """导出一张图片的YOLO标签（以及可选的 _segmented.png 预览图）
+
+    annotations 为 [(掩码, 类别ID)]。在进程池中执行，不依赖界面状态。
+    """
+    label_path, preview_path = label_paths(save_dir, image_path)
+    img_width, img_height = image_size(image_path)
+
+    lines = []
+    for mask, class_id in annotations:
+        line = mask_to_yolo_line(mask, class_id, img_width, img_height, dataset_type)
+        if line is not None:
+            lines.append(line)
+    # 标签文件原子写入，取消导出时不会留下不完整的文件
+    write_label_file(label_path, lines)
+
+    if write_preview:
+        preview = render_preview(image_path, [mask for mask, _ in annotations])
+        tmp_path = f"{os.path.splitext(preview_path)[0]}.tmp.png"
+        Image.fromarray(preview).save(tmp_path)
+        os.replace(tmp_path, preview_path)
+    return image_path
+
+
+def label_paths(save_dir, image_path):
+    """返回图片对应的 (标签文件, 预览图) 路径"""
+    img_name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(save_dir, f"{img_name}.txt"), os.path.join(save_dir, f"{img_name}_segmented.png")
+
+
+def export_key(annotations_hash, dataset_type, image_path):
+    """导出内容的哈希：标注内容、数据集类型和原图文件（图片尺寸决定坐标归一化）共同决定标签文件"""
+    stat = os.stat(image_path)
+    key = f"{annotations_hash}|{dataset_type}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def load_manifest(save_dir):
+    """读取导出清单 {图片路径: {'hash', 'preview'}}，不存在或损坏时返回空字典"""
+    try:
+        with open(os.path.join(save_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f).get('images', {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_manifest(save_dir, entries):
+    write_text_atomic(os.path.join(save_dir, MANIFEST_NAME),
+                      json.dumps({'version': 1, 'images': entries}))
+
+
+def is_up_to_date(entry, key, save_dir, image_path, write_preview):
+    """清单中的记录与当前内容一致且输出文件仍然存在时，无需重新导出"""
+    if not entry or entry.get('hash') != key:
+        return False
+    label_path, preview_path = label_paths(save_dir, image_path)
+    if not os.path.exists(label_path):
+        return False
+    if write_preview:
+        return entry.get('preview', False) and os.path.exists(preview_path)
+    return True
+
+
+class ExportJob:
+    """在进程池中导出整个数据集
+
+    load_annotations(图片路径) 返回该图片的 [(掩码, 类别ID)]，在提交任务时才调用，
+    同一时刻最多只有 max_pending 张图片的标注在传输或处理中。
+    调用方（界面线程）周期性调用 poll()，它不会阻塞。
+    """
+
+    def __init__(self, image_paths, load_annotations, save_dir, dataset_type, write_preview=True,
+                 max_workers=None, max_pending=None):
+        self.total = len(image_paths)
+        self.load_annotations = load_annotations
+        self.save_dir = save_dir
+        self.dataset_type = dataset_type
+        self.write_preview = write_preview
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_pending = max_pending or self.max_workers * 2
+        self.done = 0
+        self.exported = []  # 成功导出的图片路径
+        self.failed = []  # (图片路径, 错误信息)
+        self.cancelled = False
+        self._paths = iter(image_paths)
+        self._exhausted = False
+        self._pending = {}  # future -> 图片路径
+        self._executor = None
+
+    @property
+    def finished(self):
+        return (self._exhausted or self.cancelled) and not self._pending
+
+    def poll(self):
+        """提交新任务并收集已完成的结果，返回是否全部结束"""
+        for future in [f for f in self._pending if f.done()]:
+            image_path = self._pending.pop(future)
+            self.done += 1
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                self.exported.append(image_path)
+            else:
+                self.failed.append((image_path, str(error)))
+
+        while not self.cancelled and not self._exhausted and len(self._pending) < self.max_pending:
+            image_path = next(self._paths, None)
+            if image_path is None:
+                self._exhausted = True
+                break
+            try:
+                annotations = self.load_annotations(image_path)
+            except Exception as e:
+                # 读取标注失败只跳过这一张
+                self.done += 1
+                self.failed.append((image_path, str(e)))
+                continue
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            future = self._executor.submit(export_image, image_path, annotations, self.save_dir,
+                                           self.dataset_type, self.write_preview)
+            self._pending[future] = image_path
+
+        if self.finished:
+            self.close()
+        return self.finished
+
+    def cancel(self):
+        """取消尚未开始的任务，正在处理的图片会继续写完"""
+        self.cancelled = True
+        if self._executor is not None:
+            for future in self._pending:
+                future.cancel()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,229 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def make_cache_key(image_path, checkpoint_path, region=None):
+    """根据图片路径、修改时间和已加载的模型权重生成特征缓存键；region 为局部编码的裁剪区域 (x0, y0, x1, y1)"""
+    image_path = os.path.abspath(image_path)
+    mtime = _file_mtime(image_path)
+    checkpoint = os.path.abspath(checkpoint_path) if checkpoint_path else None
+    return (image_path, mtime, checkpoint, region)
+
+
+def features_nbytes(features):
+    """计算一组图像特征占用的字节数"""
+    tensors = [features['image_embed']] + list(features['high_res_feats'])
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def encode_image(predictor, image):
+    """只运行图像编码器并返回特征，与 predictor.set_image 的计算一致，但不修改 predictor 状态"""
+    # torch 和 sam2 在第一次编码时才导入，界面启动时不加载
+    import torch
+    from sam_model import inference_context
+
+    with torch.no_grad():
+        model = predictor.model
+        input_image = predictor._transforms(image)
+        input_image = input_image[None, ...].to(predictor.device)
+        if getattr(predictor, 'cpu_profile', None) == "fast":
+            input_image = input_image.contiguous(memory_format=torch.channels_last)
+
+        with inference_context(predictor):
+            backbone_out = model.forward_image(input_image)
+            _, vision_feats, _, _ = model._prepare_backbone_features(backbone_out)
+            # 与 set_image 相同：在最低分辨率特征上加上 no_mem_embed
+            if model.directly_add_no_mem_embed:
+                vision_feats[-1] = vision_feats[-1] + model.no_mem_embed
+
+        feats = [
+            feat.permute(1, 2, 0).view(1, -1, *feat_size)
+            for feat, feat_size in zip(vision_feats[::-1], predictor._bb_feat_sizes[::-1])
+        ][::-1]
+        return {
+            'image_embed': feats[-1],
+            'high_res_feats': feats[:-1],
+            'orig_hw': tuple(image.shape[:2]),
+        }
+
+
+def load_or_encode(predictor, image, image_path, store=None):
+    """优先从持久化存储读取整张图片的特征，没有时编码并保存"""
+    features = store.get(image_path, image.shape[:2], predictor.device) if store is not None else None
+    if features is None:
+        features = encode_image(predictor, image)
+        if store is not None:
+            store.put(image_path, features)
+    return features
+
+
+def apply_features(predictor, features):
+    """把缓存的特征写回 predictor，之后可以直接调用 predict 只运行提示/掩码解码器"""
+    predictor.reset_predictor()
+    predictor._features = {
+        'image_embed': features['image_embed'],
+        'high_res_feats': list(features['high_res_feats']),
+    }
+    predictor._orig_hw = [features['orig_hw']]
+    predictor._is_image_set = True
+
+
+class FeatureCache:
+    """SAM2 图像特征缓存，按字节预算进行 LRU 淘汰"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (features, nbytes)
+        # 预取线程与界面线程会同时访问缓存
+        self._lock = threading.Lock()
+        # 编码新特征时持有：同一张图片只编码一次，图像编码器同一时刻也只在一个线程中运行
+        self._create_lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            # 命中后移到末尾，表示最近使用
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_or_create(self, key, create):
+        """返回 key 对应的特征，没有时调用 create() 生成并缓存
+
+        检查与生成都在同一把锁内完成，另一个线程正在生成同一个键时等待它完成后直接使用结果。
+        """
+        features = self.get(key)
+        if features is not None:
+            return features
+        with self._create_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            features = create()
+            self.put(key, features)
+            return features
+
+    def put(self, key, features):
+        nbytes = features_nbytes(features)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            # 单个条目超过预算时不缓存
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (features, nbytes)
+            self.current_bytes += nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _evict(self):
+        # 从最久未使用的条目开始淘汰，直到低于预算
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes
+
+
+class FeaturePrefetcher:
+    """后台线程：提前解码目录中的前后图片，并把编码特征写入 FeatureCache"""
+
+    def __init__(self, feature_cache, max_pending=4, max_images=4):
+        self.feature_cache = feature_cache
+        self.max_images = max_images
+        self.predictor = None
+        self.checkpoint_path = None
+        self.store = None  # 持久化特征存储，有保存的特征时不再编码
+        # 有界任务队列，界面线程翻页时会用最新的任务替换旧任务
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._images = OrderedDict()  # 已解码图片 path -> (mtime, np.ndarray)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def set_model(self, predictor, checkpoint_path, store=None):
+        """模型加载完成后调用，之后的预取任务会同时提取特征（并保存到 store）"""
+        with self._lock:
+            self.predictor = predictor
+            self.checkpoint_path = checkpoint_path
+            self.store = store
+
+    def schedule(self, paths, images=None):
+        """按顺序预取给定图片，丢弃尚未开始的旧任务；images 可提供已解码的图片"""
+        images = images or {}
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        # 清空旧任务
+        while True:
+            try:
+                self._jobs.get_nowait()
+            except queue.Empty:
+                break
+        for path in paths:
+            try:
+                self._jobs.put_nowait((generation, path, images.get(path)))
+            except queue.Full:
+                break
+
+    def pop_image(self, path):
+        """取出已解码的图片，没有预取或文件已修改时返回None"""
+        with self._lock:
+            entry = self._images.pop(path, None)
+        if entry is None or entry[0] != _file_mtime(path):
+            return None
+        return entry[1]
+
+    def _run(self):
+        while True:
+            generation, path, image = self._jobs.get()
+            with self._lock:
+                # 已经翻页，跳过过期任务
+                if generation != self._generation:
+                    continue
+                predictor = self.predictor
+                checkpoint_path = self.checkpoint_path
+                store = self.store
+            try:
+                if image is None:
+                    image = np.array(Image.open(path).convert("RGB"))
+                    with self._lock:
+                        self._images[path] = (_file_mtime(path), image)
+                        while len(self._images) > self.max_images:
+                            self._images.popitem(last=False)
+                if predictor is not None:
+                    key = make_cache_key(path, checkpoint_path)
+                    # 界面线程同时需要这张图片时会等待这里完成，不会重复编码；有保存的特征时直接读取
+                    self.feature_cache.get_or_create(key, lambda: load_or_encode(predictor, image, path, store))
+            except Exception as e:
+                print(f"预取图片 {os.path.basename(path)} 时出错: {str(e)}")
+
+
+def _file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
@@ -0,0 +1,175 @@
+import os
+os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
+
+import argparse
+import hashlib
+import sys
+import threading
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from app_config import load_app_config
+from feature_cache import encode_image
+from sam_batch import list_images, read_ahead
+from sam_model import cli_config_path, load_cli_predictor
+
+# 持久化特征目录，默认位于图片所在目录下，按模型分子目录存放
+STORE_DIRNAME = ".sam2_features"
+# 特征在磁盘上的精度：与模型输出一致的 float32（约16MB/张），读取时直接映射为张量，不需要转换和拷贝
+STORE_DTYPE = np.float32
+# 每张图片的特征按顺序保存为三个 .npy 文件，image_embed 最后写入，存在即表示条目完整
+_PARTS = ("feat0", "feat1", "embed")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """计算文件内容的 sha1，图片被移动或重命名后特征仍然可以复用"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_tag(checkpoint_path, config_path, cpu_profile="default"):
+    """特征的子目录名：模型权重文件名、配置文件名，权重文件的大小和修改时间，以及推理配置
+
+    同名的不同权重（例如微调后覆盖的 sam2_hiera_large.pt）不会共用特征；
+    fast（bfloat16）和 int8 配置得到的是近似特征，各自单独保存，不会提供给浮点模型。
+    """
+    checkpoint = os.path.splitext(os.path.basename(checkpoint_path))[0]
+    config = os.path.splitext(os.path.basename(config_path))[0]
+    stat = os.stat(checkpoint_path)
+    tag = f"{checkpoint}-{config}-{stat.st_size}-{int(stat.st_mtime)}"
+    return tag if cpu_profile == "default" else f"{tag}-{cpu_profile}"
+
+
+def configured_root(app_config=None):
+    """sam_config.json 中 "feature_store" 指定的保存目录，未指定时返回None（保存在图片所在目录）"""
+    if app_config is None:
+        app_config = load_app_config()
+    root = app_config.get('feature_store')
+    return root if isinstance(root, str) and root else None
+
+
+class FeatureStore:
+    """跨会话的持久化图像特征
+
+    以图片文件内容的哈希为键，每个条目保存为 .npy 文件。读取时以写时复制的内存映射打开，
+    用 torch.from_numpy 直接包装成张量：CPU 上不产生拷贝，只有实际用到的页会从磁盘读入；
+    在 GPU 上使用时才复制一次到显存。只保存整张图片的特征，局部编码的裁剪区域不保存。
+    root 为 None 时特征保存在每张图片所在目录的 .sam2_features 下；
+    cpu_profile 为编码所用 predictor 的推理配置（predictor.cpu_profile）。
+    """
+
+    def __init__(self, checkpoint_path, config_path, root=None, dtype=STORE_DTYPE, cpu_profile="default"):
+        self.tag = model_tag(checkpoint_path, config_path, cpu_profile)
+        self.root = root
+        self.dtype = dtype
+        self._digests = {}  # (路径, 大小, 修改时间) -> 文件哈希，同一会话内不重复计算
+        # 预取线程与分割线程会同时访问
+        self._lock = threading.Lock()
+
+    def _entry_prefix(self, image_path):
+        image_path = os.path.abspath(image_path)
+        stat = os.stat(image_path)
+        key = (image_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = file_digest(image_path)
+            with self._lock:
+                self._digests[key] = digest
+        root = self.root or os.path.join(os.path.dirname(image_path), STORE_DIRNAME)
+        return os.path.join(root, self.tag, digest)
+
+    def __contains__(self, image_path):
+        try:
+            return os.path.exists(f"{self._entry_prefix(image_path)}_embed.npy")
+        except OSError:
+            return False
+
+    def get(self, image_path, orig_hw, device):
+        """读取图片的特征（格式与 encode_image 一致），没有保存过时返回None"""
+        try:
+            prefix = self._entry_prefix(image_path)
+            if not os.path.exists(f"{prefix}_embed.npy"):
+                return None
+            # mmap_mode='c'：数组可写但修改不会写回文件，torch.from_numpy 不会因只读数组发出警告
+            arrays = [np.load(f"{prefix}_{part}.npy", mmap_mode='c') for part in _PARTS]
+        except (OSError, ValueError):
+            return None
+        # 保存为 float32 且在 CPU 上使用时 to() 直接返回原张量，不产生拷贝
+        tensors = [torch.from_numpy(a).to(device=device, dtype=torch.float32) for a in arrays]
+        return {
+            'image_embed': tensors[2],
+            'high_res_feats': tensors[:2],
+            'orig_hw': tuple(orig_hw),
+        }
+
+    def put(self, image_path, features):
+        """保存图片的特征，目录不可写时不保存并返回False"""
+        tensors = list(features['high_res_feats']) + [features['image_embed']]
+        try:
+            prefix = self._entry_prefix(image_path)
+            os.makedirs(os.path.dirname(prefix), exist_ok=True)
+            for part, tensor in zip(_PARTS, tensors):
+                # 先写临时文件再替换，多个线程同时写同一条目时互不影响
+                tmp_path = f"{prefix}_{part}.{threading.get_ident()}.tmp.npy"
+                np.save(tmp_path, tensor.detach().float().cpu().numpy().astype(self.dtype, copy=False))
+                os.replace(tmp_path, f"{prefix}_{part}.npy")
+        except OSError as e:
+            print(f"保存图片 {os.path.basename(image_path)} 的特征时出错: {str(e)}")
+            return False
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SAM2 特征预编码：提前编码整个目录的图片，界面中打开这些图片时不再运行图像编码器")
+    parser.add_argument("--checkpoint", required=True, help="模型文件(.pt)")
+    parser.add_argument("--config", help="模型配置文件，默认根据模型文件名自动选择")
+    parser.add_argument("--images", required=True, help="图片目录")
+    parser.add_argument("--store", help="特征保存目录，默认为 sam_config.json 中的 feature_store，"
+                                        "未设置时为图片目录下的 .sam2_features")
+    parser.add_argument("--device", help="运行设备，例如 cpu 或 cuda，默认自动选择")
+    args = parser.parse_args(argv)
+
+    config_path = cli_config_path(args.checkpoint, args.config)
+    store = FeatureStore(args.checkpoint, config_path, root=args.store or configured_root())
+
+    # 已经保存过的图片直接跳过（断点续跑）
+    jobs = [path for path in list_images(args.images) if path not in store]
+    print(f"待编码图片 {len(jobs)} 张")
+    if not jobs:
+        return 0
+
+    predictor = load_cli_predictor(args.checkpoint, config_path, args.device)
+
+    def read(path):
+        return np.array(Image.open(path).convert("RGB"))
+
+    failed = 0
+    start = time.perf_counter()
+    # 后台线程读取下一张图片，与当前图片的编码重叠
+    for index, (image_path, image, error) in enumerate(read_ahead(jobs, read), 1):
+        if error is not None:
+            print(f"读取图片 {os.path.basename(image_path)} 时出错: {str(error)}", file=sys.stderr)
+        saved = False
+        if image is not None:
+            try:
+                saved = store.put(image_path, encode_image(predictor, image))
+            except Exception as e:
+                print(f"编码图片 {os.path.basename(image_path)} 时出错: {str(e)}", file=sys.stderr)
+        if not saved:
+            failed += 1
+        elapsed = time.perf_counter() - start
+        print(f"[{index}/{len(jobs)}] {os.path.basename(image_path)}  {index / elapsed:.2f} 张/秒", flush=True)
+
+    print(f"完成：编码 {len(jobs) - failed} 张，失败 {failed} 张，用时 {time.perf_counter() - start:.1f} 秒")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
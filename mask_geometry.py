@@ -0,0 +1,41 @@
+import numpy as np
+import cv2
+
+
+def bounding_box(mask):
+    """返回二维掩码的外接框 (x0, y0, x1, y1)，右下边界不包含；空掩码返回None
+
+    按行、列做 any 归约，不生成全部前景像素的坐标数组。
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def centroid(mask, offset=(0, 0)):
+    """用图像矩计算掩码中心 (x, y)，取整方式与前景像素坐标的均值一致；空掩码返回None
+
+    offset 为 mask 左上角在原图中的坐标。
+    """
+    moments = cv2.moments(np.asarray(mask, dtype=np.uint8), binaryImage=True)
+    if moments['m00'] == 0:
+        return None
+    return (int(moments['m10'] / moments['m00']) + offset[0], int(moments['m01'] / moments['m00']) + offset[1])
+
+
+def blend_mask(image, mask, color, alpha):
+    """把掩码按颜色半透明叠加到 image 上（原地修改）
+
+    只在掩码的外接框内混合：框外叠加的是0，结果与整幅 cv2.addWeighted 一致。
+    """
+    bbox = bounding_box(mask)
+    if bbox is None:
+        return image
+    x0, y0, x1, y1 = bbox
+    crop = mask[y0:y1, x0:x1]
+    mask_image = (crop[:, :, None] * np.asarray(color).reshape(1, 1, -1) * 255).astype(np.uint8)
+    region = image[y0:y1, x0:x1]
+    region[:] = cv2.addWeighted(region, 1, mask_image, alpha, 0)
+    return image
@@ -0,0 +1,357 @@
+import numpy as np
+import cv2
+
+from mask_geometry import bounding_box, centroid
+
+
+class CompactMask:
+    """紧凑存储的二值掩码：裁剪到外接框后用 np.packbits 按位压缩，需要时再解码"""
+
+    def __init__(self, shape, bbox, bits):
+        self.shape = tuple(shape)  # 原图尺寸 (高, 宽)
+        self.bbox = bbox  # 外接框 (x0, y0, x1, y1)，右下边界不包含；空掩码为None
+        self.bits = bits  # 外接框内像素按行展开后的压缩位
+        self._polygon = None  # vectorize() 缓存的导出多边形
+        self._centroid = None  # centroid() 缓存的中心点
+
+    ndim = 2
+
+    @classmethod
+    def from_dense(cls, mask, threshold=0.5):
+        """从完整尺寸的掩码创建"""
+        mask = to_2d_mask(np.asarray(mask)) > threshold
+        bbox = bounding_box(mask)
+        if bbox is None:
+            return cls(mask.shape, None, np.zeros(0, dtype=np.uint8))
+        return cls.from_crop(mask.shape, bbox, mask[bbox[1]:bbox[3], bbox[0]:bbox[2]])
+
+    @classmethod
+    def from_crop(cls, shape, bbox, crop):
+        """从外接框内的局部掩码创建"""
+        return cls(shape, bbox, np.packbits(np.asarray(crop, dtype=bool), axis=None))
+
+    @classmethod
+    def from_polygon(cls, points, shape):
+        """把多边形（像素坐标）直接栅格化到外接框大小的数组中"""
+        height, width = shape
+        pts = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        x0, y0 = max(0, int(pts[:, 0].min())), max(0, int(pts[:, 1].min()))
+        x1, y1 = min(width, int(pts[:, 0].max()) + 1), min(height, int(pts[:, 1].max()) + 1)
+        if x0 >= x1 or y0 >= y1:
+            return cls(shape, None, np.zeros(0, dtype=np.uint8))
+        crop = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.fillPoly(crop, [pts - (x0, y0)], 1)
+        return cls.from_crop(shape, (x0, y0, x1, y1), crop > 0)
+
+    @classmethod
+    def from_box(cls, x_min, y_min, x_max, y_max, shape):
+        """创建实心矩形掩码，与 cv2.rectangle(..., -1) 一样包含右下角像素"""
+        height, width = shape
+        x0, y0 = max(0, x_min), max(0, y_min)
+        x1, y1 = min(width, x_max + 1), min(height, y_max + 1)
+        if x0 >= x1 or y0 >= y1:
+            return cls(shape, None, np.zeros(0, dtype=np.uint8))
+        return cls.from_crop(shape, (x0, y0, x1, y1), np.ones((y1 - y0, x1 - x0), dtype=bool))
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    @property
+    def area(self):
+        return int(np.unpackbits(self.bits).sum()) if self.bbox is not None else 0
+
+    def crop(self):
+        """解码外接框内的掩码（bool）"""
+        if self.bbox is None:
+            return np.zeros((0, 0), dtype=bool)
+        x0, y0, x1, y1 = self.bbox
+        count = (x1 - x0) * (y1 - y0)
+        return np.unpackbits(self.bits, count=count).reshape(y1 - y0, x1 - x0).astype(bool)
+
+    def region(self, x0, y0, x1, y1):
+        """解码指定窗口内的掩码（bool），只展开与外接框重叠的部分"""
+        out = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        if self.bbox is None:
+            return out
+        bx0, by0, bx1, by1 = self.bbox
+        ix0, iy0 = max(x0, bx0), max(y0, by0)
+        ix1, iy1 = min(x1, bx1), min(y1, by1)
+        if ix0 < ix1 and iy0 < iy1:
+            out[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = self.crop()[iy0 - by0:iy1 - by0, ix0 - bx0:ix1 - bx0]
+        return out
+
+    def to_dense(self):
+        """解码为完整尺寸的掩码（bool）"""
+        return self.region(0, 0, self.shape[1], self.shape[0])
+
+    def translate(self, dx, dy, shape):
+        """平移到更大图片中的 (dx, dy) 位置，例如把分块内的掩码放回原图，不需要解码"""
+        if self.bbox is None:
+            return CompactMask(shape, None, self.bits)
+        x0, y0, x1, y1 = self.bbox
+        return CompactMask(shape, (x0 + dx, y0 + dy, x1 + dx, y1 + dy), self.bits)
+
+    def union(self, other):
+        """与另一个同尺寸的掩码求并集"""
+        if other.bbox is None:
+            return self
+        if self.bbox is None:
+            return other
+        bbox = (min(self.bbox[0], other.bbox[0]), min(self.bbox[1], other.bbox[1]),
+                max(self.bbox[2], other.bbox[2]), max(self.bbox[3], other.bbox[3]))
+        return CompactMask.from_crop(self.shape, bbox, self.region(*bbox) | other.region(*bbox))
+
+    def centroid(self):
+        """返回掩码中心 (x, y)，结果会被缓存；空掩码返回None"""
+        if self._centroid is None and self.bbox is not None:
+            self._centroid = centroid(self.crop(), self.bbox[:2])
+        return self._centroid
+
+    def vectorize(self):
+        """返回导出用的多边形顶点（最大外轮廓简化后的像素坐标），结果会被缓存；无法生成时返回None"""
+        if self._polygon is None and self.bbox is not None:
+            # 只在外接框（四周补一圈0）内查找轮廓，offset 换算回原图坐标，结果与整图查找一致
+            x0, y0 = self.bbox[:2]
+            self._polygon = largest_contour_polygon(np.pad(self.crop().astype(np.uint8), 1), (x0 - 1, y0 - 1))
+        return self._polygon
+
+    def fingerprint(self):
+        """掩码内容的字节表示，用于计算标注哈希"""
+        return self.bits.tobytes()
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+
+class PolygonMask(CompactMask):
+    """以矢量几何保存的掩码：多边形顶点（原图像素坐标，浮点），检测框另外保存原始框
+
+    顶点是标注的规范表示，导出时直接写出，不需要再从像素中提取轮廓；外接框直接由顶点得到。
+    不保存原图分辨率的像素数据：需要像素时按外接框临时栅格化，显示时在显示分辨率下栅格化并缓存。
+    """
+
+    def __init__(self, points, shape, box=None):
+        self.shape = tuple(shape)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.box = box  # 检测框 (中心x, 中心y, 宽, 高)，像素坐标；多边形标注为None
+        self._render_cache = None
+        self._centroid = None
+        height, width = self.shape
+        pixels = self._pixel_points()
+        (x0, y0), (x1, y1) = pixels.min(axis=0).tolist(), pixels.max(axis=0).tolist()
+        x0, y0, x1, y1 = max(0, x0), max(0, y0), min(width, x1 + 1), min(height, y1 + 1)
+        self.bbox = (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+    @classmethod
+    def from_box(cls, x_min, y_min, x_max, y_max, shape, box=None):
+        """实心矩形，与 CompactMask.from_box 一样包含右下角像素；box 为导出时使用的原始框"""
+        if x_max < x_min or y_max < y_min:
+            return CompactMask(shape, None, np.zeros(0, dtype=np.uint8))
+        return cls([(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)], shape, box)
+
+    def _pixel_points(self):
+        # 栅格化使用向零取整的像素坐标，与 CompactMask.from_polygon 的结果一致
+        return self.points.astype(np.int32)
+
+    @property
+    def bits(self):
+        if self.bbox is None:
+            return np.zeros(0, dtype=np.uint8)
+        return np.packbits(self.crop(), axis=None)
+
+    @property
+    def nbytes(self):
+        return self.points.nbytes
+
+    @property
+    def area(self):
+        return int(np.count_nonzero(self.crop()))
+
+    def crop(self):
+        """在外接框内栅格化（不缓存原图分辨率的结果）"""
+        if self.bbox is None:
+            return np.zeros((0, 0), dtype=bool)
+        x0, y0, x1, y1 = self.bbox
+        crop = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.fillPoly(crop, [self._pixel_points() - (x0, y0)], 1)
+        return crop > 0
+
+    def vectorize(self):
+        return self.points
+
+    def render(self, region, size):
+        """在显示分辨率下栅格化窗口 region 内的部分，size 为显示尺寸 (宽, 高)
+
+        只缓存与多边形重叠的那一块，视图不变时直接复用。
+        """
+        width, height = size
+        out = np.zeros((height, width), dtype=np.uint8)
+        key = (region, size)
+        if self._render_cache is None or self._render_cache[0] != key:
+            self._render_cache = (key, self._render_crop(region, size))
+        cached = self._render_cache[1]
+        if cached is not None:
+            bx, by, crop = cached
+            out[by:by + crop.shape[0], bx:bx + crop.shape[1]] = crop
+        return out
+
+    def _render_crop(self, region, size):
+        x0, y0, x1, y1 = region
+        width, height = size
+        if self.bbox is None or not (self.bbox[0] < x1 and x0 < self.bbox[2] and self.bbox[1] < y1 and y0 < self.bbox[3]):
+            return None
+        scale = np.array([width / (x1 - x0), height / (y1 - y0)])
+        # 原图像素 p 覆盖 [p, p+1)，按像素中心换算到显示坐标
+        points = (self._pixel_points() + 0.5 - (x0, y0)) * scale - 0.5
+        bx0, by0 = np.clip(np.floor(points.min(axis=0)).astype(int), 0, (width - 1, height - 1))
+        bx1, by1 = np.clip(np.ceil(points.max(axis=0)).astype(int) + 1, 1, (width, height))
+        if bx0 >= bx1 or by0 >= by1:
+            return None
+        crop = np.zeros((by1 - by0, bx1 - bx0), dtype=np.uint8)
+        # 使用4位定点坐标保留亚像素精度
+        fixed = np.round((points - (bx0, by0)) * 16).astype(np.int32)
+        cv2.fillPoly(crop, [fixed], 1, shift=4)
+        return int(bx0), int(by0), crop
+
+    def fingerprint(self):
+        return self.points.tobytes() + repr(self.box).encode()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_render_cache'] = None
+        return state
+
+
+def largest_contour_polygon(mask, offset=(0, 0)):
+    """提取最大的外轮廓并简化为多边形顶点 (N×2)，避免一个对象生成多个标签；轮廓点数不足4个时返回None"""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+    if len(contour) < 4:  # 需要至少4个点
+        return None
+
+    # 简化轮廓以减少点数
+    epsilon = 0.001 * cv2.arcLength(contour, True)
+    return cv2.approxPolyDP(contour, epsilon, True).reshape(-1, 2)
+
+
+def as_dense(mask):
+    """返回完整尺寸的二维掩码数组"""
+    if isinstance(mask, CompactMask):
+        return mask.to_dense()
+    return to_2d_mask(mask)
+
+
+def mask_region(mask, region, shape):
+    """取出掩码在原图窗口 (x0, y0, x1, y1) 内的部分，shape 为原图的 (高, 宽)"""
+    x0, y0, x1, y1 = region
+    if isinstance(mask, CompactMask) and mask.shape == tuple(shape):
+        return mask.region(x0, y0, x1, y1)
+    return to_2d_mask(as_dense(mask), shape)[y0:y1, x0:x1]
+
+
+def to_2d_mask(mask, shape=None):
+    """把掩码整理成二维数组，必要时缩放到指定的 (高, 宽)"""
+    if mask.ndim == 3:
+        if mask.shape[0] == 1:  # 移除通道维度
+            mask = mask[0]
+        else:
+            mask = mask.squeeze()
+    if shape is not None and mask.shape[:2] != tuple(shape):
+        mask = cv2.resize(mask.astype(np.uint8), (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+    return mask
+
+
+class MaskHitIndex:
+    """单张图片的标注命中索引
+
+    label_map 中每个像素记录覆盖它的最上层标注编号（0 表示无标注，i+1 表示第 i 个标注），
+    列表中越靠前的标注越优先，与逐个检查掩码时“先找到先返回”的规则一致。
+    """
+
+    def __init__(self, height, width, threshold=0.2):
+        self.shape = (height, width)
+        self.threshold = threshold
+        self.label_map = np.zeros((height, width), dtype=np.uint16)
+        self.bboxes = []  # 每个标注的外接框 (x0, y0, x1, y1)，右下边界不包含
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def rebuild(self, masks):
+        """根据掩码列表重建整个索引"""
+        self.label_map[:] = 0
+        self._ensure_capacity(len(masks))
+        crops = [self._bbox_and_crop(mask) for mask in masks]
+        self.bboxes = [bbox for bbox, _ in crops]
+        # 倒序绘制，让靠前的标注覆盖靠后的标注
+        for i in range(len(crops) - 1, -1, -1):
+            bbox, crop = crops[i]
+            if bbox is None:
+                continue
+            x0, y0, x1, y1 = bbox
+            self.label_map[y0:y1, x0:x1][crop] = i + 1
+
+    def append(self, mask):
+        """在列表末尾添加一个标注，只填充尚未被其他标注占据的像素"""
+        self._ensure_capacity(len(self.bboxes) + 1)
+        bbox, crop = self._bbox_and_crop(mask)
+        self.bboxes.append(bbox)
+        if bbox is not None:
+            x0, y0, x1, y1 = bbox
+            view = self.label_map[y0:y1, x0:x1]
+            view[crop & (view == 0)] = len(self.bboxes)
+
+    def remove(self, index, remaining_masks):
+        """删除第 index 个标注，remaining_masks 为删除后的掩码列表，只在被删除标注的区域内重新填充"""
+        bbox = self.bboxes.pop(index)
+        label = index + 1
+        if bbox is not None:
+            x0, y0, x1, y1 = bbox
+            view = self.label_map[y0:y1, x0:x1]
+            freed = view == label
+            view[freed] = 0
+        # 后面的标注编号整体前移一位
+        self.label_map[self.label_map > label] -= 1
+        if bbox is None:
+            return
+
+        # 被释放的像素由其余重叠的标注按优先级重新占据
+        for i in range(len(remaining_masks) - 1, -1, -1):
+            other = self.bboxes[i]
+            if other is None or not self._overlaps(bbox, other):
+                continue
+            mask = self._region(remaining_masks[i], bbox)
+            view[freed & mask] = i + 1
+
+    def hit(self, x, y):
+        """返回 (x, y) 处最上层标注的序号，没有标注时返回 -1"""
+        return int(self.label_map[y, x]) - 1
+
+    def _bbox_and_crop(self, mask):
+        # 紧凑掩码直接使用已知的外接框，不需要解码整张图
+        if isinstance(mask, CompactMask) and mask.shape == self.shape:
+            return mask.bbox, mask.crop()
+        mask = to_2d_mask(mask, self.shape) > self.threshold
+        bbox = bounding_box(mask)
+        if bbox is None:
+            return None, None
+        return bbox, mask[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+
+    def _region(self, mask, region):
+        if isinstance(mask, CompactMask) and mask.shape == self.shape:
+            return mask.region(*region)
+        x0, y0, x1, y1 = region
+        return to_2d_mask(mask, self.shape)[y0:y1, x0:x1] > self.threshold
+
+    def _ensure_capacity(self, count):
+        # 标注数量超过 uint16 能表示的范围时升级为 uint32
+        if count > np.iinfo(self.label_map.dtype).max:
+            self.label_map = self.label_map.astype(np.uint32)
+
+    @staticmethod
+    def _overlaps(a, b):
+        return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
@@ -0,0 +1,31 @@
+import colorsys
+import zlib
+
+import numpy as np
+
+# 按黄金角度（137.5°）递增色相，相邻序号的颜色差异最大
+GOLDEN_HUE_STEP = 137.5 / 360
+# 类别颜色表的大小，类别名称按哈希值在表中选色
+CLASS_PALETTE_SIZE = 100
+
+
+def golden_color(index):
+    """第 index 个颜色（RGB，0-1），色相超过一圈时取模，不会被截断成同一种颜色"""
+    hue = (index * GOLDEN_HUE_STEP) % 1.0
+    return np.array(colorsys.hsv_to_rgb(hue, 1.0, 1.0))
+
+
+# 预先计算的类别颜色表
+CLASS_PALETTE = [golden_color(i) for i in range(CLASS_PALETTE_SIZE)]
+
+
+def generate_colors(num_colors):
+    """生成指定数量的不同颜色"""
+    if num_colors <= CLASS_PALETTE_SIZE:
+        return CLASS_PALETTE[:num_colors]
+    return CLASS_PALETTE + [golden_color(i) for i in range(CLASS_PALETTE_SIZE, num_colors)]
+
+
+def class_color(class_name):
+    """类别名称对应的固定颜色；使用 crc32 而不是 hash()，不同会话中颜色一致"""
+    return CLASS_PALETTE[zlib.crc32(class_name.encode("utf-8")) % CLASS_PALETTE_SIZE]
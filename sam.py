@@ -1,20 +1,56 @@
 import os
 os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
 
-import torch
 import numpy as np
-import matplotlib.pyplot as plt
 from PIL import Image, ImageTk
 import cv2
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
-import os
 import json
-from sam2.build_sam import build_sam2
-from sam2.sam2_image_predictor import SAM2ImagePredictor
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app_config import POINTS_PER_SIDE, TILE_OVERLAP, TILE_SIZE, load_app_config, memory_bytes, resolve_config_path
+from dataset_export import ExportJob, export_key, is_up_to_date, load_manifest, save_manifest
+from feature_cache import FeatureCache, FeaturePrefetcher, make_cache_key, encode_image, apply_features, load_or_encode
+from mask_geometry import blend_mask, bounding_box
+from mask_utils import CompactMask, MaskHitIndex, PolygonMask, mask_region
+from palette import class_color, generate_colors
+from session_store import AnnotationStore, ResultCache
+from yolo_io import load_label_dir, match_label_files, write_classes_file
+# torch、sam2 相关模块（sam_model、feature_store、tiling）在后台线程中预先导入，用到时再在函数内导入，
+# 窗口不需要等待它们加载
 
 np.random.seed(3)
 
+# 图像特征缓存上限（字节），超出后按LRU淘汰
+FEATURE_CACHE_BYTES = 1024 ** 3
+# 分割结果缓存（候选掩码、得分、logits）的内存上限（字节），可在 sam_config.json 中用 results_cache_mb 修改
+RESULTS_CACHE_BYTES = 512 * 1024 ** 2
+# 标注在内存中的上限（字节），超出后写入磁盘临时目录，访问时自动读回；可用 annotation_memory_mb 修改
+ANNOTATION_MEMORY_BYTES = 512 * 1024 ** 2
+# 局部区域分割时裁剪区域对齐的像素网格，便于平移后复用区域特征缓存
+ROI_ALIGN = 32
+# 裁剪区域不超过整张图片面积的这个比例时才单独编码，否则直接使用整图特征
+ROI_MAX_AREA = 0.25
+# 目录模式下预取（解码+编码）后续图片的数量
+PREFETCH_AHEAD = 3
+# 分块自动分割进行中时刷新进度的间隔（毫秒）
+TILE_POLL_MS = 100
+# 后台分割期间检查结果的间隔（毫秒），约60fps
+SEGMENT_POLL_MS = 16
+# 实时分割模式下锚点变化后等待的时间（毫秒），连续点击只分割最后一次的锚点
+LIVE_SEGMENT_DELAY_MS = 80
+# 后台加载模型期间刷新进度的间隔（毫秒）
+MODEL_LOAD_POLL_MS = 100
+
+
+def _preload_model_modules():
+    """在后台线程中导入 torch 和 sam2 相关模块，第一次加载模型时不再等待导入"""
+    import sam_model  # noqa: F401
+    import feature_store  # noqa: F401
+    import tiling  # noqa: F401
+
+
 class SAMInteractiveApp:
     def __init__(self, root):
         self.root = root
@@ -22,19 +58,41 @@ class SAMInteractiveApp:
         self.root.geometry("1000x800")
         
         # 初始化变量
+        self.app_config = load_app_config()  # sam_config.json 中的配置
         self.image = None
         self.image_path = None
         self.model = None
         self.predictor = None
+        self.checkpoint_path = None  # 当前加载的模型权重路径
+        self.model_registry = None  # 常驻模型的注册表，第一次加载模型时在加载线程中创建
+        self.model_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self._model_load_stage = None  # 后台加载模型的当前阶段，由加载线程写入
+        self.feature_cache = FeatureCache(FEATURE_CACHE_BYTES)  # 图像特征缓存
+        self._predictor_key = None  # predictor中当前特征对应的缓存键
+        self.feature_store = None  # 磁盘上的持久化特征，重新打开图片时不再编码
+        # 分割、分块自动分割和切换模型都在这个工作线程中按顺序执行，只有它修改 predictor 的状态；
+        # 后台预取线程只调用图像编码器，与分割线程的编码通过 FeatureCache.get_or_create 串行执行
+        self.segment_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment")
+        self._segment_future = None  # 最近一次提交的分割任务
+        self._segment_request = None  # 最近一次提交的分割请求
+        self._live_after_id = None  # 实时分割的延迟任务
+        self._live_pending = False  # 分割进行中锚点又发生变化，完成后需要再分割一次
+        self.mask_logits = None  # 最近一次单目标分割最佳掩码的低分辨率logits {'path', 'region', 'logits'}
+        self.prefetcher = FeaturePrefetcher(self.feature_cache, max_pending=PREFETCH_AHEAD + 2,
+                                            max_images=PREFETCH_AHEAD + 2)  # 后台预取线程
+        self._tile_progress = None  # 分块自动分割的进度 (已完成, 总数)，由分割线程写入
         self.points = []
         self.labels = []
+        self.point_groups = []  # 多目标模式下每个锚点所属的目标序号
+        self.current_group = 0  # 多目标模式下正在标注的目标序号
         self.masks = None
         self.scores = None
+        self.masks_per_object = False  # True表示self.masks中每个掩码对应一个目标（多目标模式的结果）
         self.current_point_index = 0
         self.display_img = None  # 存储显示的图像引用
         self.img_scale = 1.0  # 图像缩放比例
         self.img_offset = (0, 0)  # 图像偏移量
-        self.image_results = {}  # 存储每张图片的分割结果缓存
+        self.image_results = ResultCache(memory_bytes(self.app_config, 'results_cache_mb', RESULTS_CACHE_BYTES))  # 存储每张图片的分割结果缓存（LRU）
         self.current_image_path = None  # 当前图片路径
         
         # 新增目录导航变量
@@ -45,10 +103,14 @@ class SAMInteractiveApp:
         # 多类分割相关变量
         self.class_names = []  # 存储所有已定义的类别名称
         self.class_to_id = {}  # 类别名称到ID的映射
-        self.image_annotations = {}  # 存储每张图片的标注信息，键为图片路径
+        self.image_annotations = AnnotationStore(memory_bytes(self.app_config, 'annotation_memory_mb', ANNOTATION_MEMORY_BYTES))  # 存储每张图片的标注信息，键为图片路径
         self.current_mask_id = 0  # 当前掩码ID，用于显示不同颜色
         self.current_image_annotations = []  # 当前图片的所有标注信息
         self.current_mask_bbox = None  # 当前掩码的最小矩形框
+        self._annotations_version = 0  # 当前图片标注的版本号，标注变化时递增
+        self._overlay_cache = None  # 已合成的标注图层缓存 (key, image)
+        self._class_colors = {}  # 类别名称到颜色的缓存
+        self._hit_index = None  # 当前图片标注的命中索引，用于悬停检测和右键删除
         
         # 鼠标交互相关变量
         self.selected_point_index = -1  # 选中的锚点索引
@@ -63,10 +125,20 @@ class SAMInteractiveApp:
         # 绑定快捷键
         self.root.bind_all('<KeyPress-x>', lambda event: self.perform_segmentation())
         self.root.bind_all('<Control-s>', lambda event: self.save_all_results())
+        
+        # 窗口显示后在后台导入 torch 和 sam2
+        threading.Thread(target=_preload_model_modules, daemon=True).start()
+        
+        # 配置文件中指定了默认模型时，启动后自动在后台加载
+        default_checkpoint = self.app_config.get('default_checkpoint')
+        if default_checkpoint and os.path.exists(default_checkpoint):
+            self.root.after(MODEL_LOAD_POLL_MS, self._start_model_load, default_checkpoint, self.app_config.get('config'))
         # 使用bind_all确保在任何组件获得焦点时都能响应
         self.root.bind_all('<KeyPress-s>', lambda event: self.save_current_object())
         # 绑定重置快捷键
         self.root.bind_all('<KeyPress-r>', lambda event: self.reset_app())
+        # 多目标模式下开始标注下一个目标
+        self.root.bind_all('<KeyPress-n>', lambda event: self.start_new_object())
 
     
     def _create_widgets(self):
@@ -95,6 +167,22 @@ class SAMInteractiveApp:
         self.segment_btn = ttk.Button(control_frame, text="执行分割(X)", command=self.perform_segmentation, state=tk.DISABLED)
         self.segment_btn.pack(side=tk.LEFT, padx=5)
         
+        # 多目标模式：每组锚点对应一个目标，锚点数量相同的目标一起解码
+        self.multi_object_mode = tk.BooleanVar(value=False)
+        self.multi_object_check = ttk.Checkbutton(control_frame, text="多目标(N:下一个)", variable=self.multi_object_mode,
+                                                  command=self._on_multi_object_toggled)
+        self.multi_object_check.pack(side=tk.LEFT, padx=5)
+        
+        # 实时分割：添加或取消锚点后自动分割，只运行提示/掩码解码器
+        self.live_segment = tk.BooleanVar(value=False)
+        self.live_segment_check = ttk.Checkbutton(control_frame, text="实时分割", variable=self.live_segment,
+                                                  command=self._on_live_segment_toggled)
+        self.live_segment_check.pack(side=tk.LEFT, padx=5)
+        
+        # 分块自动分割按钮：超大图片按滑动窗口逐块分割并拼接
+        self.tile_segment_btn = ttk.Button(control_frame, text="分块自动分割", command=self.auto_segment_tiles)
+        self.tile_segment_btn.pack(side=tk.LEFT, padx=5)
+        
         # 保存当前目标按钮
         self.save_object_btn = ttk.Button(control_frame, text="保存类别(S)", 
                                         command=self.save_current_object, state=tk.DISABLED)
@@ -113,6 +201,10 @@ class SAMInteractiveApp:
         self.dataset_type_combo = ttk.Combobox(control_frame, textvariable=self.dataset_type, state="readonly", width=10)
         self.dataset_type_combo['values'] = ("分割", "检测")
         self.dataset_type_combo.pack(side=tk.LEFT, padx=5)
+        
+        # 导出时是否同时保存 _segmented.png 预览图（大数据集关闭可显著加快保存）
+        self.export_preview = tk.BooleanVar(value=True)
+        ttk.Checkbutton(control_frame, text="保存预览图", variable=self.export_preview).pack(side=tk.LEFT, padx=5)
 
         # 加载标签按钮
         self.load_labels_btn = ttk.Button(control_frame, text="加载标签", command=self.load_labels, state=tk.DISABLED)
@@ -161,55 +253,60 @@ class SAMInteractiveApp:
             )
         
         if file_path:
+            # 切换图片后旧图片的分割请求不再需要
+            self._cancel_segmentation()
             # 保存当前图片的结果到缓存
             if self.current_image_path and self.masks is not None:
-                self.image_results[self.current_image_path] = {
-                    'masks': self.masks,
-                    'scores': self.scores,
-                    'points': self.points,
-                    'labels': self.labels
-                }
-            
-            # 保存当前图片的标注信息
-            if self.current_image_path and self.current_image_annotations:
-                # 使用save_current_object方法中的相同逻辑，确保不会重复保存标注
-                if self.current_image_path not in self.image_annotations:
-                    self.image_annotations[self.current_image_path] = []
-                # 只保存有变化的标注，避免重复
-                if self.current_image_path not in self.image_annotations or len(self.current_image_annotations) != len(self.image_annotations[self.current_image_path]):
-                    self.image_annotations[self.current_image_path] = self.current_image_annotations.copy()
+                self._cache_current_results()
             
             self.image_path = file_path
             self.current_image_path = file_path
             
-            # 加载原始图片
-            img = Image.open(file_path).convert("RGB")
-            self.image = np.array(img)
+            # 加载原始图片（优先使用后台预取好的图片）
+            self.image = self.prefetcher.pop_image(file_path)
+            if self.image is None:
+                img = Image.open(file_path).convert("RGB")
+                self.image = np.array(img)
             
             # 检查是否有缓存结果
             if file_path in self.image_results:
                 cached = self.image_results[file_path]
-                self.masks = cached['masks']
+                # 缓存中的候选掩码是压缩存储的，恢复时解码
+                self.masks = np.stack([m.to_dense() for m in cached['masks']])
                 self.scores = cached['scores']
                 self.points = cached['points']
                 self.labels = cached['labels']
+                self.point_groups = cached.get('groups', [0] * len(self.points))
+                self.current_group = max(self.point_groups, default=0)
+                self.masks_per_object = cached.get('per_object', False)
                 self._update_points_display()
             else:
                 self.masks = None
                 self.scores = None
+                self.masks_per_object = False
                 self.points = []
                 self.labels = []
+                self.point_groups = []
+                self.current_group = 0
                 self.current_point_index = 0
                 self.points_text.delete(1.0, tk.END)
             
             # 清除当前掩码的最小矩形框，确保它不会显示在新图像上
             self.current_mask_bbox = None
+            # 恢复上一次分割的掩码logits，继续添加锚点时在其基础上细化
+            cached = self.image_results[file_path] if file_path in self.image_results else {}
+            if cached.get('logits') is not None:
+                self.mask_logits = {'path': file_path, 'region': cached.get('logits_region'), 'logits': cached['logits']}
+            else:
+                self.mask_logits = None
             
-            # 检查是否有缓存的标注信息
+            # 检查是否有缓存的标注信息（当前图片的标注固定在内存中，必要时从磁盘读回）
+            self.image_annotations.pin(file_path)
             if file_path in self.image_annotations:
                 self.current_image_annotations = self.image_annotations[file_path]
             else:
                 self.current_image_annotations = []
+            self._on_annotations_changed()
             
             # 确保UI布局已更新以获取正确的画布尺寸
             self.root.update_idletasks()
@@ -219,6 +316,23 @@ class SAMInteractiveApp:
             self._check_enable_segment()
             self._check_enable_save_object()
             self._check_enable_save_buttons()
+            
+            # 后台预取当前图片的特征以及前后的图片
+            self._schedule_prefetch()
+    
+    def _schedule_prefetch(self):
+        """把当前图片和目录中接下来的几张图片交给后台线程解码并编码"""
+        if self.current_image_path is None:
+            return
+        paths = [self.current_image_path]
+        if (self.image_list and 0 <= self.current_image_index < len(self.image_list)
+                and self.image_list[self.current_image_index] == self.current_image_path):
+            start = self.current_image_index + 1
+            paths += self.image_list[start:start + PREFETCH_AHEAD]
+            # 同时预取上一张，方便按A回退
+            if self.current_image_index > 0:
+                paths.append(self.image_list[self.current_image_index - 1])
+        self.prefetcher.schedule(paths, images={self.current_image_path: self.image})
     
     def load_image_or_directory(self):
         # 询问用户选择文件还是目录
@@ -300,49 +414,96 @@ class SAMInteractiveApp:
             filetypes=[("Model files", "*.pt")]
         )
         if checkpoint_path:
-            try:
-                # 获取项目根目录
-                project_root = os.path.dirname(os.path.abspath(__file__))
-                
-                # 确定模型类型并选择正确的配置文件
-                checkpoint_name = os.path.basename(checkpoint_path)
-                if "large" in checkpoint_name:
-                    config_filename = "sam2_hiera_l.yaml"
-                elif "base" in checkpoint_name:
-                    config_filename = "sam2_hiera_b+.yaml"
-                elif "small" in checkpoint_name:
-                    config_filename = "sam2_hiera_s.yaml"
-                elif "tiny" in checkpoint_name:
-                    config_filename = "sam2_hiera_t.yaml"
-                else:
-                    # 默认使用large配置
-                    config_filename = "sam2_hiera_l.yaml"
-                    messagebox.showinfo("信息", "未识别的模型类型，使用默认配置")
-                
-                # 构建配置文件的可能路径
-                config_path = os.path.join(
-                    project_root, "sam2", "configs", "sam2", config_filename
-                )
-                
-                # 如果第一个路径不存在，尝试直接在sam2目录下查找
-                if not os.path.exists(config_path):
-                    config_path = os.path.join(
-                        project_root, "sam2", config_filename
-                    )
-                
-                # 验证配置文件是否存在
-                if not os.path.exists(config_path):
-                    messagebox.showerror("错误", f"配置文件不存在: {config_path}")
-                    return
-                
-                device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-                self.model = build_sam2(config_path, checkpoint_path, device=device)
-                self.predictor = SAM2ImagePredictor(self.model)
-                self.status_var.set(f"已加载模型: {os.path.basename(checkpoint_path)} ({device})")
-                self._check_enable_segment()
-            except Exception as e:
-                messagebox.showerror("错误", f"加载模型失败: {str(e)}")
-                self.status_var.set("加载模型失败")
+            self._start_model_load(checkpoint_path)
+    
+    def _start_model_load(self, checkpoint_path, config_path=None):
+        """在后台线程中加载模型（常驻的模型直接取用），界面保持响应"""
+        if config_path is None:
+            # 根据模型文件名确定配置文件
+            config_path, recognized = resolve_config_path(checkpoint_path)
+            if not recognized:
+                messagebox.showinfo("信息", "未识别的模型类型，使用默认配置")
+        
+        # 验证配置文件是否存在
+        if not os.path.exists(config_path):
+            messagebox.showerror("错误", f"配置文件不存在: {config_path}")
+            return
+        
+        self.load_model_btn.config(state=tk.DISABLED)
+        self._model_load_stage = None
+        future = self.model_executor.submit(self._load_model_in_background, checkpoint_path, config_path)
+        self._poll_model_load(future, checkpoint_path, config_path)
+    
+    def _load_model_in_background(self, checkpoint_path, config_path):
+        """在加载线程中执行，返回 (model, predictor)"""
+        from sam_model import MODEL_MEMORY_BYTES, ModelRegistry
+        
+        if self.model_registry is None:
+            # 最近使用的模型常驻内存，切换模型时不需要重新加载
+            self.model_registry = ModelRegistry(memory_bytes(self.app_config, 'model_memory_mb', MODEL_MEMORY_BYTES))
+        return self.model_registry.get(
+            checkpoint_path, config_path, self.app_config.get('device'),
+            warmup=self.app_config.get('warmup', True), progress=self._set_model_load_stage,
+            cpu_profile=self.app_config.get('cpu_profile', "default"), num_threads=self.app_config.get('num_threads'))
+    
+    def _set_model_load_stage(self, stage):
+        # 在加载线程中调用，只记录阶段，由界面线程显示
+        self._model_load_stage = stage
+    
+    def _poll_model_load(self, future, checkpoint_path, config_path):
+        name = os.path.basename(checkpoint_path)
+        if not future.done():
+            stage = self._model_load_stage
+            self.status_var.set(f"正在加载模型: {name}" + (f"（{stage}）" if stage else ""))
+            self.root.after(MODEL_LOAD_POLL_MS, self._poll_model_load, future, checkpoint_path, config_path)
+            return
+        
+        error = future.exception()
+        if error is not None:
+            self.load_model_btn.config(state=tk.NORMAL)
+            messagebox.showerror("错误", f"加载模型失败: {str(error)}")
+            self.status_var.set("加载模型失败")
+            return
+        
+        # 分割线程可能仍在使用旧模型：替换同样在分割线程中执行，排在已提交的任务之后，界面不需要等待
+        model, predictor = future.result()
+        swap = self.segment_executor.submit(self._swap_model, model, predictor, checkpoint_path, config_path)
+        self._poll_model_swap(swap, name)
+    
+    def _swap_model(self, model, predictor, checkpoint_path, config_path):
+        """在分割线程中执行：替换模型，旧模型的特征随之失效"""
+        from feature_store import FeatureStore, configured_root
+        
+        self.model, self.predictor = model, predictor
+        self.checkpoint_path = checkpoint_path
+        if self.app_config.get('feature_store', True) is False:
+            # 配置中关闭了特征的持久化
+            self.feature_store = None
+        else:
+            # 不同推理配置（fast/int8）编码的特征分开保存
+            self.feature_store = FeatureStore(checkpoint_path, config_path, root=configured_root(self.app_config),
+                                              cpu_profile=getattr(predictor, 'cpu_profile', "default"))
+        self.feature_cache.clear()
+        self._predictor_key = None
+        self.prefetcher.set_model(predictor, checkpoint_path, self.feature_store)
+    
+    def _poll_model_swap(self, future, name):
+        if not future.done():
+            self.root.after(SEGMENT_POLL_MS, self._poll_model_swap, future, name)
+            return
+        
+        self.load_model_btn.config(state=tk.NORMAL)
+        error = future.exception()
+        if error is not None:
+            messagebox.showerror("错误", f"加载模型失败: {str(error)}")
+            self.status_var.set("加载模型失败")
+            return
+        
+        # 上一次的 logits 来自旧模型
+        self.mask_logits = None
+        self._schedule_prefetch()
+        self.status_var.set(f"已加载模型: {name} ({self.predictor.device})")
+        self._check_enable_segment()
     
     def apply_num_points(self):
         try:
@@ -351,6 +512,8 @@ class SAMInteractiveApp:
             messagebox.showerror("错误", "请输入有效的数字")
     
     def reset_app(self):
+        self._cancel_segmentation()
+        self.mask_logits = None
         # 清除锚点、分割结果和缓存
         self.points = []
         self.labels = []
@@ -386,9 +549,12 @@ class SAMInteractiveApp:
         img_x = min(max(img_x, 0), img_width - 1)
         img_y = min(max(img_y, 0), img_height - 1)
 
+        # 锚点变化后，尚未开始的分割请求已经过期
+        self._cancel_segmentation()
         # 添加点和标签
         self.points.append([img_x, img_y])
         self.labels.append(1)  # 默认是正点
+        self.point_groups.append(self.current_group)
 
         # 更新显示
         self._update_points_display()
@@ -397,6 +563,7 @@ class SAMInteractiveApp:
         # 自动累加锚点
         self.status_var.set(f"已添加锚点 {len(self.points)}")
         self._check_enable_segment()
+        self._schedule_live_segmentation()
         
     def _check_enable_save_object(self):
         """检查是否可以启用保存目标按钮"""
@@ -409,24 +576,14 @@ class SAMInteractiveApp:
         """检查是否可以启用保存按钮"""
         # 检查是否有任何图像有标注结果
         has_annotations = False
-        # 添加调试信息
-        print(f"当前image_annotations字典内容: {self.image_annotations}")
-        print(f"当前current_image_path: {self.current_image_path}")
         
         # 先检查当前图像是否有标注
-        if self.current_image_path and self.current_image_path in self.image_annotations:
-            current_annotations = self.image_annotations[self.current_image_path]
-            if current_annotations:
-                has_annotations = True
-                print(f"当前图像 {self.current_image_path} 有 {len(current_annotations)} 个标注")
+        if self.current_image_path and self.image_annotations.count(self.current_image_path) > 0:
+            has_annotations = True
         
-        # 如果当前图像没有标注，再遍历整个字典检查其他图像
+        # 如果当前图像没有标注，再检查其他图像（只读取标注数量，不会从磁盘读回）
         if not has_annotations:
-            for path, annotations in self.image_annotations.items():
-                print(f"路径 {path} 有 {len(annotations)} 个标注")
-                if annotations:
-                    has_annotations = True
-                    break
+            has_annotations = self.image_annotations.has_annotations()
         
         if has_annotations:
             self.save_all_btn.config(state=tk.NORMAL)
@@ -465,63 +622,26 @@ class SAMInteractiveApp:
             
             # 获取所有已加载的图像路径
             if hasattr(self, 'image_list') and self.image_list:  # 批量加载模式
-                loaded_images = self.image_list.copy()
+                loaded_images = self.image_list
             else:  # 单张图片模式
                 loaded_images = [self.current_image_path]
             
+            # 按文件名建立索引一次性配对，再在线程池中读取（图片只读取文件头获取尺寸）
+            self.status_var.set(f"正在加载 {len(label_files)} 个标签文件...")
+            self.root.update()
+            pairs = match_label_files(label_files, loaded_images)
+            
             total_loaded = 0
             processed_images = 0
-            
-            # 首先尝试按文件名匹配
-            for label_file in label_files:
-                # 获取标签文件名（不包含扩展名）
-                label_name = os.path.splitext(label_file)[0]
-                
-                # 查找匹配的图像文件
-                matched_image = None
-                for img_path in loaded_images:
-                    img_name = os.path.splitext(os.path.basename(img_path))[0]
-                    if img_name == label_name:
-                        matched_image = img_path
-                        break
-                
-                if matched_image:
-                    # 处理匹配的图像和标签
-                    loaded_count = self._process_label_file(
-                        os.path.join(label_dir, label_file), 
-                        matched_image
-                    )
-                    total_loaded += loaded_count
-                    processed_images += 1
-                    # 从列表中移除已处理的图像
-                    loaded_images.remove(matched_image)
-                    
-                    # 如果所有图像都已处理，退出循环
-                    if not loaded_images:
-                        break
-            
-            # 确保image_annotations字典已初始化
-            if not hasattr(self, 'image_annotations'):
-                self.image_annotations = {}
-            
-            # 处理剩余的标签文件和图像（按顺序匹配）
-            # 获取已处理过的图像名称列表
-            # 已处理的图像是指从原始loaded_images中移除的那些
-            original_loaded_images = [self.current_image_path] if not hasattr(self, 'image_list') or not self.image_list else self.image_list
-            processed_image_names = [os.path.splitext(os.path.basename(img))[0] for img in original_loaded_images if img not in loaded_images]
-            remaining_label_files = [f for f in label_files if os.path.splitext(f)[0] not in processed_image_names]
-            
-            min_count = min(len(remaining_label_files), len(loaded_images))
-            for i in range(min_count):
-                loaded_count = self._process_label_file(
-                    os.path.join(label_dir, remaining_label_files[i]), 
-                    loaded_images[i]
-                )
-                total_loaded += loaded_count
+            for image_path, labels in load_label_dir(label_dir, pairs):
+                if isinstance(labels, Exception):
+                    print(f"处理图片 {os.path.basename(image_path)} 的标签时出错: {str(labels)}")
+                    continue
+                total_loaded += self._process_label_file(image_path, labels)
                 processed_images += 1
             
             # 更新状态和显示
-            self.status_var.set(f"成功批量加载{total_loaded - 1}个标注，共处理{processed_images}个图像")
+            self.status_var.set(f"成功批量加载{total_loaded}个标注，共处理{processed_images}个图像")
             
             # 如果当前有图像显示，刷新显示
             if self.current_image_path:
@@ -532,118 +652,40 @@ class SAMInteractiveApp:
         except Exception as e:
             messagebox.showerror("错误", f"加载标签失败: {str(e)}")
             
-    def _process_label_file(self, label_file_path, image_path):
-        """处理单个标签文件并加载到对应的图像"""
-        try:
-            # 加载原始图像以获取尺寸
-            img = Image.open(image_path)
-            img_width, img_height = img.size
-            
-            # 读取标签文件
-            with open(label_file_path, 'r') as f:
-                lines = f.readlines()
-            
-            # 清除该图像的现有标注
-            self.image_annotations[image_path] = []
-            loaded_count = 0
-            
-            # 解析每一行标签
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # 分割行数据
-                parts = line.split()
-                if len(parts) < 5:  # 至少需要类别索引和坐标信息
-                    continue
-                
-                # 获取类别索引
-                class_id = int(parts[0])
-                
-                # 获取类别名称
-                class_name = f"类别{class_id}"
-                if self.class_names and class_id < len(self.class_names):
-                    class_name = self.class_names[class_id]
-                
-                # 创建掩码
-                mask = np.zeros((img_height, img_width), dtype=np.uint8)
-                
-                # 自动识别标签类型
-                # 分割标签: 通常有多个坐标点（点数>4）
-                # 检测标签: 通常有4个值（中心x, 中心y, 宽度, 高度）
-                if len(parts) == 5:  # 可能是检测标签（YOLO格式）
-                    try:
-                        # 解析边界框信息
-                        center_x = float(parts[1])
-                        center_y = float(parts[2])
-                        width = float(parts[3])
-                        height = float(parts[4])
-                        
-                        # 转换为实际像素坐标
-                        x_min = int((center_x - width/2) * img_width)
-                        y_min = int((center_y - height/2) * img_height)
-                        x_max = int((center_x + width/2) * img_width)
-                        y_max = int((center_y + height/2) * img_height)
-                        
-                        # 绘制矩形边界框到掩码
-                        cv2.rectangle(mask, (x_min, y_min), (x_max, y_max), 1, -1)
-                        
-                        # 添加到标注中
-                        self.image_annotations[image_path].append({
-                            'mask': mask,
-                            'class_id': class_id,
-                            'class_name': class_name
-                        })
-                        loaded_count += 1
-                    except:
-                        # 如果解析失败，尝试作为分割标签处理
-                        pass
-                
-                # 尝试作为分割标签处理（多边形顶点）
-                if len(self.image_annotations[image_path]) == loaded_count:  # 前面没有成功添加
-                    try:
-                        # 解析多边形顶点坐标
-                        points = []
-                        for i in range(1, len(parts), 2):
-                            if i+1 < len(parts):
-                                # 坐标是归一化的，需要转换回原始尺寸
-                                norm_x = float(parts[i])
-                                norm_y = float(parts[i+1])
-                                x = int(norm_x * img_width)
-                                y = int(norm_y * img_height)
-                                points.append((x, y))
-                        
-                        # 如果有足够的点，绘制多边形到掩码
-                        if len(points) >= 3:
-                            pts = np.array(points, dtype=np.int32)
-                            cv2.fillPoly(mask, [pts], 1)
-                            
-                            # 添加到标注中
-                            self.image_annotations[image_path].append({
-                                'mask': mask,
-                                'class_id': class_id,
-                                'class_name': class_name
-                            })
-                            loaded_count += 1
-                    except:
-                        # 解析失败，跳过此行
-                        continue
-            
-            # 如果当前正在显示这个图像，更新当前图像的标注
-            if image_path == self.current_image_path:
-                self.current_image_annotations = self.image_annotations[image_path].copy()
-            
-            return loaded_count
-        except Exception as e:
-            print(f"处理标签文件 {os.path.basename(label_file_path)} 时出错: {str(e)}")
-            return 0
+    def _process_label_file(self, image_path, labels):
+        """把一个标签文件解析出的 [(类别ID, 掩码)] 加载到对应的图像，替换其现有标注"""
+        annotations = []
+        for class_id, mask in labels:
+            # 获取类别名称
+            class_name = f"类别{class_id}"
+            if self.class_names and class_id < len(self.class_names):
+                class_name = self.class_names[class_id]
+            annotations.append({
+                'mask': mask,
+                'class_id': class_id,
+                'class_name': class_name
+            })
+        
+        self.image_annotations[image_path] = annotations
+        self.image_annotations.mark_dirty(image_path)
+        
+        # 如果当前正在显示这个图像，更新当前图像的标注
+        if image_path == self.current_image_path:
+            self.current_image_annotations = annotations
+            self._on_annotations_changed()
+        
+        return len(annotations)
     
     def on_canvas_right_click(self, event):
         # 优先检查是否右键点击在已分割区域上
         if self.hovered_mask_index != -1:
             # 获取要移除的掩码信息
             removed_annotation = self.current_image_annotations.pop(self.hovered_mask_index)
+            # 只在被删除掩码的区域内更新命中索引
+            if self._hit_index is not None:
+                self._hit_index.remove(self.hovered_mask_index, [a['mask'] for a in self.current_image_annotations])
+            self._on_annotations_changed(rebuild_index=False)
+            self.image_annotations.mark_dirty(self.current_image_path)
             self.hovered_mask_index = -1  # 重置悬停状态
             self.status_var.set(f"已取消分割区域: {removed_annotation['class_name']}")
             
@@ -665,22 +707,29 @@ class SAMInteractiveApp:
             # 确保更新分割按钮状态
             self._check_enable_segment()
         elif self.points:
+            self._cancel_segmentation()
             # 如果有选中的锚点，移除它
             if self.selected_point_index != -1:
                 removed_point = self.points.pop(self.selected_point_index)
                 self.labels.pop(self.selected_point_index)
+                self.point_groups.pop(self.selected_point_index)
                 self.selected_point_index = -1
                 self.status_var.set(f"已取消选中的锚点，当前锚点数量: {len(self.points)}")
             else:
                 # 否则移除最后一个锚点
                 removed_point = self.points.pop()
                 self.labels.pop()
+                self.point_groups.pop()
                 self.status_var.set(f"已取消上一个锚点，当前锚点数量: {len(self.points)}")
             
+            # 上一次的掩码包含了被移除锚点的作用，不能再作为细化的起点
+            self.mask_logits = None
+            
             # 刷新显示
             self._update_points_display()
             self._display_image()  # 重新显示图片
             self._check_enable_segment()
+            self._schedule_live_segmentation()
         else:
             self.status_var.set("没有可取消的锚点或分割区域")
     
@@ -767,25 +816,18 @@ class SAMInteractiveApp:
         # 获取鼠标在画布上的位置
         mouse_x, mouse_y = event.x, event.y
         
-        # 检查锚点悬停
+        # 检查锚点悬停：一次计算所有锚点到鼠标的距离
         closest_point_index = -1
         min_distance = 30  # 像素距离阈值
-        
-        # 检查每个锚点
-        for i, (x, y) in enumerate(self.points):
+        if self.points:
             # 将图像坐标转换为画布坐标
-            canvas_x = int(x * self.img_scale) + self.img_offset[0]
-            canvas_y = int(y * self.img_scale) + self.img_offset[1]
-            
-            # 计算鼠标与锚点的距离
-            distance = ((mouse_x - canvas_x) **2 + (mouse_y - canvas_y)** 2) ** 0.5
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest_point_index = i
+            canvas_points = np.floor(np.asarray(self.points, dtype=np.float64) * self.img_scale) + self.img_offset
+            distances = np.hypot(canvas_points[:, 0] - mouse_x, canvas_points[:, 1] - mouse_y)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] < min_distance:
+                closest_point_index = nearest
         
         # 检查掩码悬停
-        hovered_mask_index = -1
         img_height, img_width = self.image.shape[:2]
         
         # 计算实际图像坐标
@@ -796,24 +838,8 @@ class SAMInteractiveApp:
         img_x = min(max(img_x, 0), img_width - 1)
         img_y = min(max(img_y, 0), img_height - 1)
         
-        # 检查是否在已分割区域上
-        for i, annotation in enumerate(self.current_image_annotations):
-            mask = annotation['mask']
-            # 处理掩码维度，确保它是二维的
-            if mask.ndim == 3:
-                if mask.shape[0] == 1:  # 移除通道维度
-                    mask = mask[0]
-                else:
-                    mask = mask.squeeze()
-            
-            # 调整掩码尺寸以匹配原图
-            if mask.shape[:2] != (img_height, img_width):
-                mask = cv2.resize(mask, (img_width, img_height), interpolation=cv2.INTER_NEAREST)
-            
-            # 使用更敏感的阈值检查该点是否在掩码内
-            if mask[img_y, img_x] > 0.2:  # 降低阈值以提高检测灵敏度
-                hovered_mask_index = i
-                break
+        # 通过命中索引直接查出该像素上的标注
+        hovered_mask_index = self._get_hit_index().hit(img_x, img_y)
         
         # 如果选中的锚点或悬停的掩码发生变化，更新状态并重新显示
         if closest_point_index != self.selected_point_index or hovered_mask_index != self.hovered_mask_index:
@@ -824,7 +850,160 @@ class SAMInteractiveApp:
     def _update_points_display(self):
         self.points_text.delete(1.0, tk.END)
         for i, (x, y) in enumerate(self.points):
-            self.points_text.insert(tk.END, f"点 {i+1}: ({x}, {y})\n")
+            if self.multi_object_mode.get():
+                self.points_text.insert(tk.END, f"点 {i+1}: ({x}, {y}) 目标{self.point_groups[i] + 1}\n")
+            else:
+                self.points_text.insert(tk.END, f"点 {i+1}: ({x}, {y})\n")
+    
+    def _on_multi_object_toggled(self):
+        """切换多目标模式时，已有锚点全部归入当前目标"""
+        self.current_group = 0
+        self.point_groups = [0] * len(self.points)
+        # 提示方式改变后重新从头分割，不沿用上一次单目标分割的logits
+        self.mask_logits = None
+        self._update_points_display()
+        if self.multi_object_mode.get():
+            self.status_var.set("多目标模式：每组锚点对应一个目标，按N开始下一个目标，按X一次分割所有目标")
+        else:
+            self.status_var.set("已关闭多目标模式")
+    
+    def _on_live_segment_toggled(self):
+        if self.live_segment.get():
+            self.status_var.set("实时分割：添加或取消锚点后自动分割")
+            self._schedule_live_segmentation()
+        else:
+            self.status_var.set("已关闭实时分割")
+    
+    def _schedule_live_segmentation(self):
+        """实时分割模式下延迟触发分割，延迟期间锚点再次变化时重新计时"""
+        if not self.live_segment.get():
+            return
+        if self._live_after_id is not None:
+            self.root.after_cancel(self._live_after_id)
+        self._live_after_id = self.root.after(LIVE_SEGMENT_DELAY_MS, self._run_live_segmentation)
+    
+    def _run_live_segmentation(self):
+        self._live_after_id = None
+        if self.image is None or self.predictor is None or not self.points:
+            return
+        # 上一次分割还在进行：完成后再用最新的锚点分割一次
+        if self._segment_future is not None and not self._segment_future.done():
+            self._live_pending = True
+            return
+        self.perform_segmentation()
+    
+    def start_new_object(self):
+        """多目标模式下开始标注下一个目标"""
+        if not self.multi_object_mode.get():
+            return
+        # 当前目标还没有锚点时不新建
+        if self.current_group in self.point_groups:
+            self.current_group = max(self.point_groups) + 1
+        self.status_var.set(f"正在标注目标 {self.current_group + 1}")
+    
+    @staticmethod
+    def _object_prompts(points, labels, groups, negative_points, origin=(0, 0)):
+        """按目标分组整理锚点，每个目标都附加已保存区域的负点；origin 为裁剪区域左上角"""
+        prompts = []
+        for group in sorted(set(groups)):
+            indices = [i for i, g in enumerate(groups) if g == group]
+            group_points = [[points[i][0] - origin[0], points[i][1] - origin[1]] for i in indices] + negative_points
+            group_labels = [labels[i] for i in indices] + [0] * len(negative_points)
+            prompts.append({
+                'points': np.array(group_points, dtype=np.float32),
+                'labels': np.array(group_labels, dtype=np.int32),
+                'box': None,
+            })
+        return prompts
+    
+    def _view_region(self, canvas_width, canvas_height):
+        """计算画布中可见的原图区域，返回 (x0, y0, x1, y1) 以及该区域在缩放后图像中的起点和尺寸"""
+        img_height, img_width = self.image.shape[:2]
+        scale = self.img_scale
+        
+        # 画布可见范围对应的原图坐标（与on_zoom中的 偏移量/缩放比例 换算一致）
+        x0 = max(0, int(np.floor(-self.img_offset[0] / scale)))
+        y0 = max(0, int(np.floor(-self.img_offset[1] / scale)))
+        x1 = min(img_width, int(np.ceil((canvas_width - self.img_offset[0]) / scale)))
+        y1 = min(img_height, int(np.ceil((canvas_height - self.img_offset[1]) / scale)))
+        if x0 >= x1 or y0 >= y1:
+            return None
+        
+        # 可见区域在完整缩放图像中的像素范围
+        dx0, dy0 = int(x0 * scale), int(y0 * scale)
+        dw = max(1, int(x1 * scale) - dx0)
+        dh = max(1, int(y1 * scale) - dy0)
+        return (x0, y0, x1, y1), (dx0, dy0), (dw, dh)
+    
+    def _mask_view(self, mask, region, size):
+        """裁剪掩码的可见区域并缩放到显示尺寸"""
+        # 矢量标注直接在显示分辨率下栅格化
+        if isinstance(mask, PolygonMask) and mask.shape == self.image.shape[:2]:
+            return mask.render(region, size)
+        # 压缩掩码只解码可见区域；尺寸与原图不一致的掩码先调整到原图尺寸
+        crop = mask_region(mask, region, self.image.shape[:2]).astype(np.uint8)
+        return cv2.resize(crop, size, interpolation=cv2.INTER_NEAREST)
+    
+    def _on_annotations_changed(self, rebuild_index=True):
+        """当前图片的标注列表发生变化时调用，使已合成的标注图层失效；已增量更新命中索引时传入 rebuild_index=False"""
+        self._annotations_version += 1
+        self._overlay_cache = None
+        if rebuild_index:
+            self._hit_index = None
+    
+    def _get_hit_index(self):
+        """获取当前图片的命中索引，失效后按需重建"""
+        if self._hit_index is None:
+            img_height, img_width = self.image.shape[:2]
+            self._hit_index = MaskHitIndex(img_height, img_width)
+            self._hit_index.rebuild([a['mask'] for a in self.current_image_annotations])
+        return self._hit_index
+    
+    def _class_color(self, class_name):
+        """获取类别对应的固定颜色"""
+        if class_name not in self._class_colors:
+            # 按类名在预先计算的颜色表中选色，每次启动颜色一致
+            self._class_colors[class_name] = class_color(class_name)
+        return self._class_colors[class_name]
+    
+    def _annotation_layer(self, region, origin, display_size):
+        """返回可见区域的底图与所有已保存掩码、矩形框合成后的图层（BGR），结果会被缓存"""
+        key = (self._annotations_version, id(self.image), region, origin, display_size)
+        if self._overlay_cache is not None and self._overlay_cache[0] == key:
+            return self._overlay_cache[1]
+        
+        x0, y0, x1, y1 = region
+        dx0, dy0 = origin
+        # 裁剪可见区域并缩放到显示尺寸
+        layer = cv2.resize(self.image[y0:y1, x0:x1], display_size)
+        # 由于OpenCV操作使用BGR格式，而我们的图像是RGB格式，需要转换
+        layer = cv2.cvtColor(layer, cv2.COLOR_RGB2BGR)
+        
+        # 绘制所有保存的掩码和对应的矩形框
+        for annotation in self.current_image_annotations:
+            mask = self._mask_view(annotation['mask'], region, display_size)
+            base_color = self._class_color(annotation['class_name'])  # 基础颜色
+            
+            h, w = mask.shape[-2:]
+            mask_image = mask.reshape(h, w, 1) * base_color.reshape(1, 1, -1) * 255
+            mask_image = mask_image.astype(np.uint8)
+            layer = cv2.addWeighted(layer, 1, mask_image, 0.5, 0)
+            
+            # 绘制保存的矩形框（如果有）
+            if 'bbox' in annotation and annotation['bbox'] is not None:
+                x_min, y_min, x_max, y_max = annotation['bbox']
+                # 调整坐标以匹配显示区域
+                scaled_x_min = int(x_min * self.img_scale) - dx0
+                scaled_y_min = int(y_min * self.img_scale) - dy0
+                scaled_x_max = int(x_max * self.img_scale) - dx0
+                scaled_y_max = int(y_max * self.img_scale) - dy0
+                # 使用已经为该类别生成的颜色
+                bgr_color = (int(base_color[2] * 255), int(base_color[1] * 255), int(base_color[0] * 255))
+                # 绘制矩形框（使用与掩码相同的颜色，线宽为2）
+                cv2.rectangle(layer, (scaled_x_min, scaled_y_min), (scaled_x_max, scaled_y_max), bgr_color, 2)
+        
+        self._overlay_cache = (key, layer)
+        return layer
     
     def _display_image(self):
         if self.image is None:
@@ -833,11 +1012,6 @@ class SAMInteractiveApp:
         # 确保获取最新的画布尺寸
         self.canvas.update_idletasks()
         
-        # 创建图像的副本进行显示
-        display_img = self.image.copy()
-        # 由于OpenCV操作使用BGR格式，而我们的图像是RGB格式，需要转换
-        display_img = cv2.cvtColor(display_img, cv2.COLOR_RGB2BGR)
-        
         # 调整图像大小以适应画布
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
@@ -846,7 +1020,7 @@ class SAMInteractiveApp:
         canvas_width = max(canvas_width, 1)
         canvas_height = max(canvas_height, 1)
         
-        img_height, img_width = display_img.shape[:2]
+        img_height, img_width = self.image.shape[:2]
         
         # 如果是首次显示图像（img_scale未设置），则自动计算缩放比例使其正好占满视窗
         if not hasattr(self, 'img_scale') or self.img_scale is None:
@@ -864,114 +1038,70 @@ class SAMInteractiveApp:
             self.img_offset = ((canvas_width - new_width) // 2, (canvas_height - new_height) // 2)
             self.has_displayed = True
         
-        # 调整图像大小
-        display_img = cv2.resize(display_img, (new_width, new_height))
+        self.canvas.delete("all")
         
-        # 绘制点
-        for i, (x, y) in enumerate(self.points):
-            # 根据是否被选中确定颜色
-            if i == self.selected_point_index:
-                color = (0, 255, 0)  # 绿色点，表示可选
-            else:
-                color = (0, 0, 255)  # 红色点
-            # 由于我们是在调整大小后的图像上绘制点，所以直接使用原始坐标乘以缩放比例
-            scaled_x = int(x * self.img_scale)
-            scaled_y = int(y * self.img_scale)
-            cv2.circle(display_img, (scaled_x, scaled_y), 8, color, -1)
-            cv2.putText(display_img, f"{i+1}", (scaled_x+10, scaled_y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        # 只处理画布中可见的区域，避免放大时生成整张放大后的图像
+        view = self._view_region(canvas_width, canvas_height)
+        if view is None:
+            return
+        region, (dx0, dy0), display_size = view
         
-        # 为每个类别生成固定颜色
-        class_colors = {}
-        for annotation in self.current_image_annotations:
-            class_name = annotation['class_name']
-            if class_name not in class_colors:
-                # 使用类名的哈希值生成一致的颜色
-                color_index = hash(class_name) % 100
-                hue = color_index * (137.5 / 360)
-                rgb = plt.cm.hsv(hue)
-                class_colors[class_name] = np.array([rgb[0], rgb[1], rgb[2]])
+        # 已保存标注的合成图层只在标注、缩放或视图变化时重新生成
+        display_img = self._annotation_layer(region, (dx0, dy0), display_size).copy()
         
-        # 绘制所有保存的掩码和对应的矩形框
-        for i, annotation in enumerate(self.current_image_annotations):
-            mask = annotation['mask']
-            # 确保掩码是二维的
-            if mask.ndim == 3:
-                if mask.shape[0] == 1:
-                    mask = mask[0]
-                else:
-                    mask = mask.squeeze()
-            
-            # 确保掩码数据类型正确
-            mask = mask.astype(np.uint8)
-            class_name = annotation['class_name']
-            base_color = class_colors[class_name]  # 基础颜色
-            
-            # 定义选中和非选中状态的颜色
-            if i == self.hovered_mask_index:
-                # 悬停状态：使用暗绿色表示选中
-                dark_green = np.array([0.0, 0.5, 0.0])  # 暗绿色RGB值
-                color = dark_green
-            else:
-                # 非悬停状态：保持原有类别的基础颜色不变
-                color = base_color
-            
-            h, w = mask.shape[-2:]
-            mask_image = mask.reshape(h, w, 1) * color.reshape(1, 1, -1) * 255
-            mask_image = mask_image.astype(np.uint8)
-            
-            # 调整掩码图像尺寸以匹配显示图像
-            mask_image = cv2.resize(mask_image, (display_img.shape[1], display_img.shape[0]))
-            
-            # 当鼠标悬停在该掩码上时，加深颜色（使用更高的alpha值）
-            alpha = 0.8 if i == self.hovered_mask_index else 0.5
-            display_img = cv2.addWeighted(display_img, 1, mask_image, alpha, 0)
-            
-            # 绘制保存的矩形框（如果有）
-            if 'bbox' in annotation and annotation['bbox'] is not None:
-                x_min, y_min, x_max, y_max = annotation['bbox']
-                # 调整坐标以匹配显示图像的尺寸
-                scaled_x_min = int(x_min * self.img_scale)
-                scaled_y_min = int(y_min * self.img_scale)
-                scaled_x_max = int(x_max * self.img_scale)
-                scaled_y_max = int(y_max * self.img_scale)
-                # 使用已经为该类别生成的颜色
-                bgr_color = (int(base_color[2] * 255), int(base_color[1] * 255), int(base_color[0] * 255))
-                # 绘制矩形框（使用与掩码相同的颜色，线宽为2）
-                cv2.rectangle(display_img, (scaled_x_min, scaled_y_min), (scaled_x_max, scaled_y_max), bgr_color, 2)
+        # 悬停的掩码单独叠加一层高亮，只处理该掩码的外接区域
+        if 0 <= self.hovered_mask_index < len(self.current_image_annotations):
+            mask = self._mask_view(self.current_image_annotations[self.hovered_mask_index]['mask'], region, display_size)
+            # 悬停状态：使用暗绿色表示选中
+            dark_green = np.array([0.0, 0.5, 0.0])  # 暗绿色RGB值
+            blend_mask(display_img, mask, dark_green, 0.8)
         
         # 绘制当前掩码（如果有）
         if self.masks is not None:
-            mask = self.masks[0]  # 使用得分最高的掩码
-            color = np.array([30/255, 144/255, 255/255])  # 使用蓝色显示当前掩码
-            h, w = mask.shape[-2:]
-            mask = mask.astype(np.uint8)
-            mask_image = mask.reshape(h, w, 1) * color.reshape(1, 1, -1) * 255
-            mask_image = mask_image.astype(np.uint8)
-            
-            # 调整掩码图像尺寸以匹配显示图像
-            mask_image = cv2.resize(mask_image, (display_img.shape[1], display_img.shape[0]))
-            
-            # 将掩码叠加到图像上
-            display_img = cv2.addWeighted(display_img, 1, mask_image, 0.5, 0)
+            if self.masks_per_object:
+                # 多目标模式：每个目标使用不同颜色
+                current_masks = self.masks
+                colors = self._generate_colors(len(self.masks))
+            else:
+                current_masks = self.masks[:1]  # 使用得分最高的掩码
+                colors = [np.array([30/255, 144/255, 255/255])]  # 使用蓝色显示当前掩码
+            for current_mask, color in zip(current_masks, colors):
+                mask = self._mask_view(current_mask, region, display_size)
+                # 将掩码叠加到图像上（只混合掩码的外接区域）
+                blend_mask(display_img, mask, color, 0.5)
         
         # 绘制当前掩码的最小矩形框（如果有）
         if self.current_mask_bbox is not None and self.masks is not None:
             x_min, y_min, x_max, y_max = self.current_mask_bbox
-            # 调整坐标以匹配显示图像的尺寸
-            scaled_x_min = int(x_min * self.img_scale)
-            scaled_y_min = int(y_min * self.img_scale)
-            scaled_x_max = int(x_max * self.img_scale)
-            scaled_y_max = int(y_max * self.img_scale)
+            # 调整坐标以匹配显示区域
+            scaled_x_min = int(x_min * self.img_scale) - dx0
+            scaled_y_min = int(y_min * self.img_scale) - dy0
+            scaled_x_max = int(x_max * self.img_scale) - dx0
+            scaled_y_max = int(y_max * self.img_scale) - dy0
             # 绘制矩形框（使用蓝色，线宽为2）
             cv2.rectangle(display_img, (scaled_x_min, scaled_y_min), (scaled_x_max, scaled_y_max), (255, 0, 0), 2)
         
+        # 绘制点（位于最上层）
+        for i, (x, y) in enumerate(self.points):
+            # 根据是否被选中确定颜色
+            if i == self.selected_point_index:
+                color = (0, 255, 0)  # 绿色点，表示可选
+            else:
+                color = (0, 0, 255)  # 红色点
+            # 原始坐标乘以缩放比例，再减去可见区域的起点
+            scaled_x = int(x * self.img_scale) - dx0
+            scaled_y = int(y * self.img_scale) - dy0
+            cv2.circle(display_img, (scaled_x, scaled_y), 8, color, -1)
+            # 多目标模式下标注为 目标序号-锚点序号
+            text = f"{self.point_groups[i]+1}-{i+1}" if self.multi_object_mode.get() else f"{i+1}"
+            cv2.putText(display_img, text, (scaled_x+10, scaled_y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        
         # 将BGR格式转换回RGB格式以在Tkinter中正确显示
         display_img = cv2.cvtColor(display_img, cv2.COLOR_BGR2RGB)
         self.display_img = ImageTk.PhotoImage(image=Image.fromarray(display_img))
         
-        # 在画布上显示图像
-        self.canvas.delete("all")
-        self.canvas.create_image(self.img_offset[0], self.img_offset[1], image=self.display_img, anchor=tk.NW)
+        # 在画布上显示可见区域（位置为图像偏移量加上可见区域的起点）
+        self.canvas.create_image(self.img_offset[0] + dx0, self.img_offset[1] + dy0, image=self.display_img, anchor=tk.NW)
     
     def _check_enable_segment(self):
         if self.image is not None and self.predictor is not None and len(self.points) > 0:
@@ -979,7 +1109,81 @@ class SAMInteractiveApp:
         else:
             self.segment_btn.config(state=tk.DISABLED)
     
+    def _cache_current_results(self):
+        """把当前图片的分割结果以压缩掩码的形式保存到缓存"""
+        logits = self.mask_logits
+        if logits is not None and logits['path'] != self.current_image_path:
+            logits = None
+        self.image_results[self.current_image_path] = {
+            'masks': [CompactMask.from_dense(mask) for mask in self.masks],
+            'scores': self.scores,
+            'points': self.points.copy(),
+            'labels': self.labels.copy(),
+            'groups': self.point_groups.copy(),
+            'per_object': self.masks_per_object,
+            # 得分最高掩码的低分辨率logits，作为下一次分割的 mask_input
+            'logits': logits['logits'] if logits is not None else None,
+            'logits_region': logits['region'] if logits is not None else None,
+        }
+    
+    def _prepare_image_features(self, image, image_path, region=None):
+        """为图片（或其中的裁剪区域 region）准备编码特征，命中缓存时跳过图像编码器（在分割线程中调用）"""
+        key = make_cache_key(image_path, self.checkpoint_path, region)
+        # predictor中已经是当前图片的特征
+        if key == self._predictor_key:
+            return
+        
+        # 后台预取线程正在编码当前图片时等待它完成，不重复编码
+        if region is None:
+            # 整张图片优先使用磁盘上保存的特征
+            features = self.feature_cache.get_or_create(
+                key, lambda: load_or_encode(self.predictor, image, image_path, self.feature_store))
+        else:
+            # 裁剪区域作为独立的图片，以模型的完整输入分辨率编码
+            features = self.feature_cache.get_or_create(
+                key, lambda: encode_image(self.predictor, self._region_image(image, region)))
+        apply_features(self.predictor, features)
+        self._predictor_key = key
+    
+    @staticmethod
+    def _region_image(image, region):
+        """取出需要编码的图片：整张图片，或者作为独立图片的裁剪区域"""
+        if region is None:
+            return image
+        x0, y0, x1, y1 = region
+        return np.ascontiguousarray(image[y0:y1, x0:x1])
+    
+    def _segmentation_region(self):
+        """计算局部分割的区域：放大查看局部时为当前视图范围并包含所有锚点，否则返回None"""
+        h, w = self.image.shape[:2]
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        
+        # 没有放大到超过占满视窗的比例时分割整张图片
+        fit_scale = max(canvas_width / w, canvas_height / h)
+        if self.img_scale <= fit_scale * 1.01:
+            return None
+        
+        # 当前视图在原始图像中的范围，与显示时的换算一致
+        view = self._view_region(canvas_width, canvas_height)
+        if view is None:
+            return None
+        x0, y0, x1, y1 = view[0]
+        
+        # 确保所有锚点都在区域内
+        if self.points:
+            points = np.asarray(self.points)
+            x0, y0 = min(x0, int(points[:, 0].min())), min(y0, int(points[:, 1].min()))
+            x1, y1 = max(x1, int(points[:, 0].max()) + 1), max(y1, int(points[:, 1].max()) + 1)
+        
+        # 向外对齐到网格，小幅平移后仍能命中同一个区域的特征缓存
+        x0, y0 = x0 // ROI_ALIGN * ROI_ALIGN, y0 // ROI_ALIGN * ROI_ALIGN
+        x1 = min(w, -(-x1 // ROI_ALIGN) * ROI_ALIGN)
+        y1 = min(h, -(-y1 // ROI_ALIGN) * ROI_ALIGN)
+        return (x0, y0, x1, y1)
+    
     def perform_segmentation(self):
+        """提交一次分割请求，在分割线程中执行，完成后由界面线程应用结果"""
         if self.image is None or self.predictor is None:
             messagebox.showerror("错误", "请先加载图片和模型")
             return
@@ -988,114 +1192,184 @@ class SAMInteractiveApp:
             messagebox.showerror("错误", "请至少选择一个点")
             return
         
-        try:
-            self.status_var.set("正在执行分割...")
-            self.root.update()
-            
-            # 设置图像
-            self.predictor.set_image(self.image)
-            
-            # 准备点数据
-            input_point = np.array(self.points)
-            input_label = np.array(self.labels)
-            
-            # 检查是否有已分割的区域需要排除
-            if self.current_image_annotations:
-                # 为每个已分割区域的中心添加一个负点标签（值为0），表示排除的区域
-                for annotation in self.current_image_annotations:
-                    mask = annotation['mask']
-                    # 找到掩码的中心点
-                    coords = np.column_stack(np.where(mask))
-                    if coords.size > 0:
-                        center = coords.mean(axis=0).astype(int)
-                        # 将中心点添加为负点
-                        input_point = np.vstack([input_point, [center[1], center[0]]])  # 注意这里是 [x, y]
-                        input_label = np.append(input_label, 0)  # 0表示负点
-            
-            # 注意：取消锚点后，用户可以重新选择锚点进行分割，
-            # 这种情况下已保存的区域仍然会被锁定，但用户可以通过删除整个标注来解除锁定
+        request = {
+            'image': self.image,
+            'path': self.current_image_path,
+            'points': [list(p) for p in self.points],
+            'labels': list(self.labels),
+            'groups': list(self.point_groups),
+            'multi_object': self.multi_object_mode.get(),
+            # 放大查看局部时只分割可见区域
+            'region': self._segmentation_region(),
+            'annotations': list(self.current_image_annotations),
+            'mask_input': None,
+        }
+        # 已有分割结果时在其基础上细化（同一图片、同一裁剪区域的单目标分割）：
+        # 上一次最佳掩码的logits作为 mask_input，只解码一个掩码；第一次分割才输出多个候选
+        logits = self.mask_logits
+        if not request['multi_object'] and logits is not None \
+                and logits['path'] == request['path'] and logits['region'] == request['region']:
+            request['mask_input'] = logits['logits']
+        # 按住X时的重复按键：相同的请求已在处理中，不再重复提交
+        if self._segment_future is not None and not self._segment_future.done() and self._same_request(request, self._segment_request):
+            return
+        
+        # 取消尚未开始的旧请求，正在执行的旧请求完成后结果会被丢弃
+        self._cancel_segmentation()
+        self.status_var.set("正在执行分割...")
+        future = self.segment_executor.submit(self._run_segmentation, request)
+        self._segment_future, self._segment_request = future, request
+        self.root.after(SEGMENT_POLL_MS, self._poll_segmentation, future, request)
+    
+    @staticmethod
+    def _same_request(a, b):
+        """两个分割请求的输入是否相同"""
+        keys = ('path', 'points', 'labels', 'groups', 'multi_object', 'region')
+        return b is not None and all(a[k] == b[k] for k in keys) and len(a['annotations']) == len(b['annotations'])
+    
+    def _cancel_segmentation(self):
+        """取消尚未开始执行的分割请求"""
+        if self._segment_future is not None:
+            self._segment_future.cancel()
+    
+    def _run_segmentation(self, request):
+        """在分割线程中执行：准备特征、解码，并把掩码映射回原图坐标"""
+        from sam_model import inference_context, predict_objects
+        
+        image = request['image']
+        region = request['region']
+        # 区域远小于整张图片时以模型的完整输入分辨率单独编码，小目标可以获得更高的分辨率；
+        # 否则使用整图特征（可以命中预取好的缓存），只保留区域内的结果
+        h, w = image.shape[:2]
+        crop = None
+        if region is not None and (region[2] - region[0]) * (region[3] - region[1]) <= ROI_MAX_AREA * w * h:
+            crop = region
+        origin = np.array(crop[:2]) if crop is not None else np.zeros(2, dtype=int)
+        
+        # 设置图像（命中特征缓存时只运行提示/掩码解码器）
+        self._prepare_image_features(image, request['path'], crop)
+        
+        # 检查是否有已分割的区域需要排除
+        # 为每个已分割区域的中心添加一个负点标签（值为0），表示排除的区域
+        negative_points = []
+        for annotation in request['annotations']:
+            # 找到掩码的中心点 (x, y)
+            center = annotation['mask'].centroid()
+            if center is None:
+                continue
+            # 局部分割时只保留裁剪区域内的负点
+            if crop is not None and not (crop[0] <= center[0] < crop[2] and crop[1] <= center[1] < crop[3]):
+                continue
+            negative_points.append([center[0] - origin[0], center[1] - origin[1]])
+        
+        # 注意：取消锚点后，用户可以重新选择锚点进行分割，
+        # 这种情况下已保存的区域仍然会被锁定，但用户可以通过删除整个标注来解除锁定
+        
+        if request['multi_object']:
+            # 多目标模式：锚点数量相同的目标在同一次解码器调用中完成，每个目标保留得分最高的掩码
+            prompts = self._object_prompts(request['points'], request['labels'], request['groups'],
+                                           negative_points, origin)
+            with inference_context(self.predictor):
+                masks, scores = predict_objects(self.predictor, prompts)
+            masks = np.stack(masks).astype(np.float32)
+            scores = np.array(scores)
+        else:
+            # 准备点数据（转换到裁剪区域坐标）
+            input_point = np.array(request['points']) - origin
+            input_label = np.array(request['labels'])
+            if negative_points:
+                input_point = np.vstack([input_point, negative_points])
+                input_label = np.append(input_label, [0] * len(negative_points))  # 0表示负点
             
             # 执行预测 - 设置normalize_coords=True让predictor处理坐标归一化
-            masks, scores, logits = self.predictor.predict(
-                point_coords=input_point,
-                point_labels=input_label,
-                multimask_output=True,
-                normalize_coords=True
-            )
+            # 有上一次的掩码logits时只输出一个细化后的掩码
+            mask_input = request['mask_input']
+            with inference_context(self.predictor):
+                masks, scores, logits = self.predictor.predict(
+                    point_coords=input_point,
+                    point_labels=input_label,
+                    mask_input=mask_input[None] if mask_input is not None else None,
+                    multimask_output=mask_input is None,
+                    normalize_coords=True
+                )
             
             # 按得分排序
             sorted_ind = np.argsort(scores)[::-1]
-            self.masks = masks[sorted_ind]
-            self.scores = scores[sorted_ind]
-            
-            # 确保分割处理当前缩放尺寸下的工作区域
-            # 获取当前画布显示区域的像素边界
-            h, w = self.image.shape[:2]
-            
-            # 计算当前视图在原始图像中的边界
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
-            
-            # 计算视图区域在原始图像中的坐标范围
-            view_x_min = max(0, int((-self.img_offset[0]) / self.img_scale))
-            view_y_min = max(0, int((-self.img_offset[1]) / self.img_scale))
-            view_x_max = min(w, int((-self.img_offset[0] + canvas_width) / self.img_scale))
-            view_y_max = min(h, int((-self.img_offset[1] + canvas_height) / self.img_scale))
-            
-            # 在状态栏显示当前分割范围信息
-            self.status_var.set(f"分割处理区域: x({view_x_min}-{view_x_max}), y({view_y_min}-{view_y_max})，缩放比例: {self.img_scale:.2f}x")
-            
-            # 实际分割时，我们通过修改掩码后处理来限制结果范围
-            # 确保掩码只在当前视图范围内有效
-            view_masks = []
-            for mask in self.masks:
-                # 创建一个与原掩码相同大小的零矩阵
-                view_mask = np.zeros_like(mask)
-                # 只保留视图范围内的掩码值
-                if mask.ndim == 3:
-                    view_mask[:, view_y_min:view_y_max, view_x_min:view_x_max] = mask[:, view_y_min:view_y_max, view_x_min:view_x_max]
-                else:
-                    view_mask[view_y_min:view_y_max, view_x_min:view_x_max] = mask[view_y_min:view_y_max, view_x_min:view_x_max]
-                view_masks.append(view_mask)
-            
-            # 使用限制后的掩码
-            self.masks = np.array(view_masks)
-            
-            # 保存结果到缓存
-            if self.current_image_path:
-                self.image_results[self.current_image_path] = {
-                    'masks': self.masks,
-                    'scores': self.scores,
-                    'points': self.points.copy(),
-                    'labels': self.labels.copy()
-                }
-            
-            self.status_var.set(f"分割完成，最高得分: {self.scores[0]:.3f}")
-            self.save_all_btn.config(state=tk.NORMAL)
-            self._check_enable_save_object()
-            
-            # 计算并保存覆盖整个掩码的最小矩形框
-            if self.masks is not None and len(self.masks) > 0:
-                # 获取得分最高的掩码
-                mask = self.masks[0]
-                # 找到掩码中的所有非零像素坐标
-                coords = np.column_stack(np.where(mask > 0.5))
-                if coords.size > 0:
-                    # 计算最小外接矩形
-                    y_min, x_min = coords.min(axis=0)
-                    y_max, x_max = coords.max(axis=0)
-                    # 保存矩形框坐标
-                    self.current_mask_bbox = (x_min, y_min, x_max, y_max)
-                else:
-                    self.current_mask_bbox = None
-            else:
-                self.current_mask_bbox = None
-            
-            # 显示结果
-            self._display_image()
-        except Exception as e:
-            messagebox.showerror("错误", f"分割失败: {str(e)}")
+            masks = masks[sorted_ind]
+            scores = scores[sorted_ind]
+            best_logits = logits[sorted_ind[0]]
+        
+        # 局部分割的结果映射回原图坐标，区域外的部分清零
+        if region is not None:
+            x0, y0, x1, y1 = region
+            full_masks = np.zeros((len(masks), h, w), dtype=masks.dtype)
+            full_masks[:, y0:y1, x0:x1] = masks if crop is not None else masks[:, y0:y1, x0:x1]
+            masks = full_masks
+        
+        # 计算覆盖整个掩码的最小矩形框（多目标模式在保存时逐个计算）
+        bbox = None
+        if len(masks) > 0 and not request['multi_object']:
+            # 得分最高的掩码，外接框右下角坐标包含在内
+            box = bounding_box(masks[0] > 0.5)
+            if box is not None:
+                x_min, y_min, x_max, y_max = box
+                bbox = (x_min, y_min, x_max - 1, y_max - 1)
+        return {'masks': masks, 'scores': scores, 'bbox': bbox,
+                'logits': None if request['multi_object'] else best_logits}
+    
+    def _poll_segmentation(self, future, request):
+        """在界面线程中检查分割任务，完成后应用结果；过期的结果直接丢弃"""
+        if not future.done():
+            self.root.after(SEGMENT_POLL_MS, self._poll_segmentation, future, request)
+            return
+        if future.cancelled() or future is not self._segment_future:
+            return
+        self._segment_future = None
+        if self._live_pending:
+            # 分割期间锚点发生了变化，用最新的锚点再分割一次
+            self._live_pending = False
+            self._schedule_live_segmentation()
+        
+        # 图片或锚点在分割期间发生了变化
+        if request['path'] != self.current_image_path or request['points'] != self.points \
+                or request['labels'] != self.labels or request['groups'] != self.point_groups:
+            self.status_var.set("锚点已变化，已丢弃过期的分割结果")
+            return
+        
+        error = future.exception()
+        if error is not None:
+            messagebox.showerror("错误", f"分割失败: {str(error)}")
             self.status_var.set("分割失败")
+            return
+        
+        result = future.result()
+        self.masks = result['masks']
+        self.scores = result['scores']
+        self.masks_per_object = request['multi_object']
+        self.current_mask_bbox = result['bbox']
+        # 多目标分割不返回logits，之后的单目标分割也不沿用更早的结果
+        self.mask_logits = None
+        if result['logits'] is not None:
+            self.mask_logits = {'path': request['path'], 'region': request['region'], 'logits': result['logits']}
+        
+        # 保存结果到缓存
+        if self.current_image_path:
+            self._cache_current_results()
+        
+        region = request['region']
+        if self.masks_per_object:
+            self.status_var.set(f"分割完成，共 {len(self.masks)} 个目标，最低得分: {self.scores.min():.3f}")
+        else:
+            self.status_var.set(f"分割完成，最高得分: {self.scores[0]:.3f}")
+        if region is not None:
+            # 在状态栏显示当前分割范围信息
+            x0, y0, x1, y1 = region
+            self.status_var.set(f"{self.status_var.get()}，分割处理区域: x({x0}-{x1}), y({y0}-{y1})，缩放比例: {self.img_scale:.2f}x")
+        self.save_all_btn.config(state=tk.NORMAL)
+        self._check_enable_save_object()
+        
+        # 显示结果
+        self._display_image()
     
     def save_current_object(self):
         """保存当前分割的目标到标注列表"""
@@ -1115,37 +1389,55 @@ class SAMInteractiveApp:
         
         class_id = self.class_to_id[class_name]
         
-        # 保存当前掩码、类别信息和矩形框
-        annotation = {
-            'mask': self.masks[0].copy(),
-            'class_id': class_id,
-            'class_name': class_name,
-            'mask_id': self.current_mask_id,
-            'bbox': self.current_mask_bbox  # 保存矩形框信息
-        }
-        
-        self.current_image_annotations.append(annotation)
+        # 多目标模式下每个目标都保存为同一类别的标注
+        masks = self.masks if self.masks_per_object else self.masks[:1]
+        for mask in masks:
+            compact = CompactMask.from_dense(mask)  # 按外接框压缩存储
+            compact.vectorize()  # 保存时提取一次导出用的多边形，导出时不再查找轮廓
+            if self.masks_per_object:
+                # 逐个目标计算最小矩形框（右下角坐标包含在内）
+                bbox = None if compact.bbox is None else (
+                    compact.bbox[0], compact.bbox[1], compact.bbox[2] - 1, compact.bbox[3] - 1)
+            else:
+                bbox = self.current_mask_bbox
+            
+            # 保存当前掩码、类别信息和矩形框
+            annotation = {
+                'mask': compact,
+                'class_id': class_id,
+                'class_name': class_name,
+                'mask_id': self.current_mask_id,
+                'bbox': bbox  # 保存矩形框信息
+            }
+            
+            self.current_image_annotations.append(annotation)
+            # 新标注优先级最低，只需把它填充到命中索引的空白像素
+            if self._hit_index is not None:
+                self._hit_index.append(annotation['mask'])
+            self.current_mask_id += 1
+        self._on_annotations_changed(rebuild_index=False)
         
         # 同时更新到 image_annotations 字典中，确保可以通过 save_all_results 保存
         # 使用 current_image_path 而不是 image_path，确保路径一致
-        if self.current_image_path not in self.image_annotations:
-            self.image_annotations[self.current_image_path] = []
-        self.image_annotations[self.current_image_path].append(annotation)
+        # 两者共用同一个列表，避免重复追加或删除后不同步
+        self.image_annotations[self.current_image_path] = self.current_image_annotations
+        self.image_annotations.mark_dirty(self.current_image_path)
         
         # 更新保存按钮状态
         self._check_enable_save_buttons()
         
-        self.current_mask_id += 1
-        
         # 显示已保存的所有掩码
         self._display_image()
         
         # 保存目标后锚点消失，让用户开始新的分割
         self.points = []
         self.labels = []
+        self.point_groups = []
+        self.current_group = 0
         self.selected_point_index = -1
         self.hovered_mask_index = -1  # 重置悬停的掩码索引
         self.current_mask_bbox = None  # 清除当前的矩形框
+        self.mask_logits = None
         self._update_points_display()
         self._check_enable_segment()
         
@@ -1153,6 +1445,127 @@ class SAMInteractiveApp:
         self.save_object_btn.config(state=tk.DISABLED)
         self.save_all_btn.config(state=tk.NORMAL)
         
+    def _ask_tile_settings(self):
+        """分块参数对话框，返回 (分块边长, 重叠宽度, 每边提示点数)，取消时返回None"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("分块自动分割")
+        dialog.geometry("300x180")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        result = [None]
+        fields = [("分块边长(像素):", TILE_SIZE), ("重叠宽度(像素):", TILE_OVERLAP), ("每边提示点数:", POINTS_PER_SIDE)]
+        variables = []
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.X)
+        for row, (text, default) in enumerate(fields):
+            tk.Label(frame, text=text).grid(row=row, column=0, sticky="w", pady=3)
+            var = tk.StringVar(value=str(default))
+            ttk.Entry(frame, textvariable=var, width=10).grid(row=row, column=1, pady=3)
+            variables.append(var)
+        
+        def on_ok():
+            try:
+                tile_size, overlap, points_per_side = (int(var.get()) for var in variables)
+            except ValueError:
+                messagebox.showwarning("警告", "请输入整数")
+                return
+            if tile_size <= 0 or points_per_side <= 0 or not 0 <= overlap < tile_size:
+                messagebox.showwarning("警告", "重叠宽度需小于分块边长，且各项需为正数")
+                return
+            result[0] = (tile_size, overlap, points_per_side)
+            dialog.destroy()
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text="确定", command=on_ok).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="取消", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        dialog.bind("<Return>", lambda event: on_ok())
+        dialog.bind("<Escape>", lambda event: dialog.destroy())
+        
+        self.root.wait_window(dialog)
+        return result[0]
+    
+    def auto_segment_tiles(self):
+        """按滑动窗口分块自动分割当前图片，结果保存为所选类别的标注"""
+        if self.image is None or self.predictor is None:
+            messagebox.showerror("错误", "请先加载图片和模型")
+            return
+        
+        settings = self._ask_tile_settings()
+        if settings is None:
+            return
+        class_name = self._show_class_selection_dialog()
+        if not class_name:
+            return
+        if class_name not in self.class_to_id:
+            self.class_names.append(class_name)
+            self.class_to_id[class_name] = len(self.class_to_id)
+        class_id = self.class_to_id[class_name]
+        
+        # 与普通分割一样在分割线程中执行，之后提交的分割会排在它后面；完成前不能再次启动
+        self._cancel_segmentation()
+        self._tile_progress = None
+        self.tile_segment_btn.config(state=tk.DISABLED)
+        self.status_var.set("正在执行分块自动分割...")
+        future = self.segment_executor.submit(self._run_tile_segmentation, self.image, settings)
+        # 记录启动时的图片和标注列表，期间切换了图片时不应用结果
+        self._poll_tile_segmentation(future, self.current_image_path, self.current_image_annotations,
+                                     class_name, class_id)
+    
+    def _run_tile_segmentation(self, image, settings):
+        """在分割线程中执行分块自动分割"""
+        from sam_model import inference_context
+        from tiling import segment_tiles
+        
+        # predictor 中的特征会被分块覆盖，之后的分割需要重新准备当前图片的特征
+        self._predictor_key = None
+        tile_size, overlap, points_per_side = settings
+        
+        def report(done, total):
+            self._tile_progress = (done, total)
+        
+        with inference_context(self.predictor):
+            return segment_tiles(self.predictor, image, tile_size, overlap, points_per_side, progress=report)
+    
+    def _poll_tile_segmentation(self, future, image_path, annotations, class_name, class_id):
+        """在界面线程中显示分块进度，完成后把结果保存为标注"""
+        if not future.done():
+            if self._tile_progress is not None:
+                done, total = self._tile_progress
+                self.status_var.set(f"分块自动分割: {done}/{total}")
+            self.root.after(TILE_POLL_MS, self._poll_tile_segmentation, future, image_path, annotations,
+                            class_name, class_id)
+            return
+        
+        self.tile_segment_btn.config(state=tk.NORMAL)
+        error = future.exception()
+        if error is not None:
+            messagebox.showerror("错误", f"分块自动分割时出错: {str(error)}")
+            self.status_var.set("分块自动分割失败")
+            return
+        if image_path != self.current_image_path or annotations is not self.current_image_annotations:
+            self.status_var.set("图片已切换，已丢弃分块自动分割的结果")
+            return
+        
+        objects = future.result()
+        for obj in objects:
+            x0, y0, x1, y1 = obj['mask'].bbox
+            self.current_image_annotations.append({
+                'mask': obj['mask'],
+                'class_id': class_id,
+                'class_name': class_name,
+                'mask_id': self.current_mask_id,
+                'bbox': (x0, y0, x1 - 1, y1 - 1)
+            })
+            self.current_mask_id += 1
+        self.image_annotations[self.current_image_path] = self.current_image_annotations
+        self.image_annotations.mark_dirty(self.current_image_path)
+        self._on_annotations_changed()
+        self._check_enable_save_buttons()
+        self._display_image()
+        self.status_var.set(f"分块自动分割完成：新增 {len(objects)} 个 {class_name} 目标")
+    
     def _show_class_selection_dialog(self):
         """显示类别选择对话框"""
         # 获取当前鼠标位置
@@ -1273,6 +1686,7 @@ class SAMInteractiveApp:
                             for annotation in self.current_image_annotations:
                                 if annotation['class_name'] == n:
                                     annotation['class_name'] = new_name
+                            self._on_annotations_changed()
                             
                             # 更新输入框和刷新界面
                             class_entry_var.set(new_name)
@@ -1337,6 +1751,7 @@ class SAMInteractiveApp:
                                             for annotation in self.current_image_annotations:
                                                 if annotation['class_name'] == n:
                                                     annotation['class_name'] = new_name
+                                            self._on_annotations_changed()
                                             
                                             # 更新输入框和刷新界面
                                             class_entry_var.set(new_name)
@@ -1423,11 +1838,7 @@ class SAMInteractiveApp:
             return
         
         # 检查是否有任何图像有标注结果
-        has_annotations = False
-        for path, annotations in self.image_annotations.items():
-            if annotations:
-                has_annotations = True
-                break
+        has_annotations = self.image_annotations.has_annotations()
         
         if not has_annotations:
             messagebox.showerror("错误", "没有可保存的标注结果")
@@ -1436,134 +1847,119 @@ class SAMInteractiveApp:
         # 获取用户选择的数据集类型
         dataset_type = self.dataset_type.get()
         
+        write_preview = self.export_preview.get()
+        
+        # 增量导出：导出清单记录了每张图片上次导出内容的哈希，内容未变化且输出文件仍在的图片直接跳过；
+        # 未修改的图片使用缓存的标注哈希，不需要从磁盘读回标注
+        manifest = load_manifest(save_dir)
+        image_paths = []
+        export_keys = {}
+        skipped_count = 0
         try:
-            # 为每个有标注的图像保存结果
-            saved_count = 0
-            for image_path, annotations in self.image_annotations.items():
-                if not annotations:
+            for path in self.image_annotations:
+                # 标注已全部删除的图片，如果之前导出过则重新写入空标签
+                if self.image_annotations.count(path) == 0 and path not in manifest:
                     continue
-                
                 try:
-                    # 获取图片名称（不包含扩展名）
-                    img_name = os.path.splitext(os.path.basename(image_path))[0]
-                    
-                    # 绘制并保存分割图像
-                    segmented_file_path = os.path.join(save_dir, f"{img_name}_segmented.png")
-                    
-                    # 加载原始图像
-                    image = np.array(Image.open(image_path).convert("RGB"))
-                    result_img = image.copy()
-                    
-                    # 保存为YOLO格式的标签文件
-                    yolo_file_path = os.path.join(save_dir, f"{img_name}.txt")
-                    
-                    # 读取原始图像尺寸
-                    original_img = Image.open(image_path)
-                    img_width, img_height = original_img.size
-                    
-                    with open(yolo_file_path, "w") as f:
-                        # 对每个标注生成YOLO格式数据
-                        for annotation in annotations:
-                            class_id = annotation['class_id']
-                            
-                            if dataset_type == "分割":
-                                # 分割数据集 - 保存多边形顶点坐标
-                                mask = annotation['mask'].astype(np.uint8)
-                                
-                                # 查找轮廓
-                                contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                                
-                                # 只处理最大的轮廓或第一个轮廓，避免一个对象生成多个标签
-                                if contours:
-                                    # 选择最大的轮廓
-                                    contour = max(contours, key=cv2.contourArea)
-                                    
-                                    if len(contour) >= 4:  # 需要至少4个点
-                                        # 简化轮廓以减少点数
-                                        epsilon = 0.001 * cv2.arcLength(contour, True)
-                                        approx = cv2.approxPolyDP(contour, epsilon, True)
-                                        
-                                        # 构建多边形顶点的归一化坐标列表
-                                        polygon_points = []
-                                        for point in approx:
-                                            x, y = point[0]
-                                            # 归一化坐标到0-1范围
-                                            norm_x = x / img_width
-                                            norm_y = y / img_height
-                                            polygon_points.append(f"{norm_x:.6f}")
-                                            polygon_points.append(f"{norm_y:.6f}")
-                                        
-                                        # 写入分割标签格式的数据：类别 顶点坐标列表
-                                        f.write(f"{class_id} {' '.join(polygon_points)}\n")
-                            else:
-                                # 检测数据集 - 只保存边界框
-                                mask = annotation['mask'].astype(np.uint8)
-                                
-                                # 查找掩码中的所有非零像素坐标
-                                coords = np.column_stack(np.where(mask > 0.5))
-                                if coords.size > 0:
-                                    # 计算边界框
-                                    y_min, x_min = coords.min(axis=0)
-                                    y_max, x_max = coords.max(axis=0)
-                                    
-                                    # 计算中心坐标和宽高，并归一化到0-1范围
-                                    center_x = (x_min + x_max) / (2 * img_width)
-                                    center_y = (y_min + y_max) / (2 * img_height)
-                                    width = (x_max - x_min) / img_width
-                                    height = (y_max - y_min) / img_height
-                                    
-                                    # 写入YOLO格式的数据：类别 中心x 中心y 宽度 高度
-                                    f.write(f"{class_id} {center_x:.6f} {center_y:.6f} {width:.6f} {height:.6f}\n")
-                
-                    # 绘制所有掩码到分割图像
-                    colors = self._generate_colors(len(annotations))
-                    for i, annotation in enumerate(annotations):
-                        mask = annotation['mask'].astype(np.uint8)
-                        color = colors[i]  # 使用预先生成的颜色
-                        
-                        h, w = mask.shape[-2:]
-                        mask_image = mask.reshape(h, w, 1) * color.reshape(1, 1, -1) * 255
-                        mask_image = mask_image.astype(np.uint8)
-                        
-                        # 确保掩码图像尺寸与原始图像匹配
-                        mask_image = cv2.resize(mask_image, (result_img.shape[1], result_img.shape[0]))
-                        
-                        # 将掩码叠加到图像上
-                        result_img = cv2.addWeighted(result_img, 1, mask_image, 0.5, 0)
-                        
-                    # 保存分割图像
-                    Image.fromarray(result_img).save(segmented_file_path)
-                    saved_count += 1
-                except Exception as img_err:
-                    messagebox.showwarning("警告", f"处理图像 {os.path.basename(image_path)} 时出错: {str(img_err)}")
+                    key = export_key(self.image_annotations.digest(path), dataset_type, path)
+                except OSError:
+                    # 原图无法访问，交给导出任务报告错误
+                    image_paths.append(path)
                     continue
-            
-            # 保存类别映射文件
-            classes_file_path = os.path.join(save_dir, "classes.txt")
+                if is_up_to_date(manifest.get(path), key, save_dir, path, write_preview):
+                    skipped_count += 1
+                    continue
+                image_paths.append(path)
+                export_keys[path] = key
+        except Exception as e:
+            messagebox.showerror("错误", f"保存失败: {str(e)}")
+            return
+        
+        def load_annotations(image_path):
+            # 已写入磁盘的标注不会被重新放回内存
+            return [(a['mask'], a['class_id']) for a in self.image_annotations.peek(image_path)]
+        
+        try:
+            job = ExportJob(image_paths, load_annotations, save_dir, dataset_type, write_preview)
+        except Exception as e:
+            messagebox.showerror("错误", f"保存失败: {str(e)}")
+            return
+        
+        # 进度对话框：导出在进程池中进行，界面保持响应，可随时取消
+        dialog = tk.Toplevel(self.root)
+        dialog.title("正在保存")
+        dialog.geometry("360x120")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        progress_var = tk.StringVar(value=f"0/{job.total}")
+        tk.Label(dialog, textvariable=progress_var, pady=5).pack()
+        progress_bar = ttk.Progressbar(dialog, maximum=max(1, job.total), length=320)
+        progress_bar.pack(padx=10)
+        
+        def on_cancel():
+            job.cancel()
+            progress_var.set("正在取消...")
+        
+        ttk.Button(dialog, text="取消", command=on_cancel).pack(pady=10)
+        dialog.protocol("WM_DELETE_WINDOW", on_cancel)
+        
+        def poll():
+            try:
+                finished = job.poll()
+            except Exception as e:
+                job.cancel()
+                job.close()
+                dialog.destroy()
+                messagebox.showerror("错误", f"保存失败: {str(e)}")
+                return
+            progress_bar['value'] = job.done
+            if not job.cancelled:
+                progress_var.set(f"{job.done}/{job.total}")
+            if not finished:
+                self.root.after(50, poll)
+                return
+            dialog.destroy()
+            # 记录已导出图片的内容哈希（取消时也保留已完成的部分）
+            for path in job.exported:
+                if path in export_keys:
+                    manifest[path] = {'hash': export_keys[path], 'preview': write_preview}
+            self._finish_export(job, save_dir, dataset_type, manifest, skipped_count)
+        
+        poll()
+    
+    def _finish_export(self, job, save_dir, dataset_type, manifest, skipped_count):
+        """导出结束后保存导出清单、类别映射文件并汇总结果"""
+        # 保存类别映射文件
+        classes_file_path = os.path.join(save_dir, "classes.txt")
+        try:
+            save_manifest(save_dir, manifest)
             if self.class_names:
-                with open(classes_file_path, "w") as f:
-                    for class_name in self.class_names:
-                        f.write(f"{self.class_to_id[class_name]} {class_name}\n")
-            
-            messagebox.showinfo("成功", f"已完成所有保存，共保存了 {saved_count} 个图像的标注结果\n数据集类型: {dataset_type}\n类别映射保存在:\n{classes_file_path}")
+                write_classes_file(classes_file_path, self.class_names, self.class_to_id)
         except Exception as e:
             messagebox.showerror("错误", f"保存失败: {str(e)}")
+            return
+        
+        if job.failed:
+            # 只列出前几张出错的图片，避免弹出大量对话框
+            details = "\n".join(f"{os.path.basename(path)}: {err}" for path, err in job.failed[:5])
+            more = f"\n……共 {len(job.failed)} 张" if len(job.failed) > 5 else ""
+            messagebox.showwarning("警告", f"以下图像处理时出错:\n{details}{more}")
+        
+        saved_count = len(job.exported)
+        if job.cancelled:
+            self.status_var.set(f"已取消保存，已保存 {saved_count}/{job.total} 个图像的标注结果")
+            return
+        self.status_var.set(f"已保存 {saved_count} 个图像的标注结果，{skipped_count} 个未变化已跳过")
+        messagebox.showinfo("成功", f"已完成所有保存，共保存了 {saved_count} 个图像的标注结果（{skipped_count} 个未变化已跳过）\n数据集类型: {dataset_type}\n类别映射保存在:\n{classes_file_path}")
         
     def _generate_colors(self, num_colors):
-        """生成指定数量的不同颜色"""
-        colors = []
-        for i in range(num_colors):
-            # 使用HSV颜色空间，确保颜色分布均匀
-            hue = i * (137.5 / 360)  # 使用黄金角度分割，获得更多样化的颜色
-            saturation = 0.8
-            value = 0.9
-            
-            # 转换为RGB
-            rgb = plt.cm.hsv(hue)
-            colors.append(np.array([rgb[0], rgb[1], rgb[2]]))
-        return colors
+        """生成指定数量的不同颜色（与导出预览图的配色一致）"""
+        return generate_colors(num_colors)
         
     def reset_app(self):
+        self._cancel_segmentation()
+        self.mask_logits = None
         # 清除锚点、分割结果和缓存
         self.points = []
         self.labels = []
@@ -1571,6 +1967,7 @@ class SAMInteractiveApp:
         self.scores = None
         self.current_point_index = 0
         self.current_image_annotations = []
+        self._on_annotations_changed()
         self.current_mask_id = 0
         
         # 清除当前图片的缓存结果
@@ -1588,10 +1985,13 @@ class SAMInteractiveApp:
 
         self.points = []
         self.labels = []
+        self.point_groups = []
+        self.current_group = 0
         self.current_point_index = 0
         self.segmented_image = None
         self.masks = None
         self.scores = None
+        self.masks_per_object = False
         self.points_text.delete(1.0, tk.END)
         
         # 清除当前图片的缓存结果
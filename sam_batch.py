@@ -0,0 +1,198 @@
+import os
+os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from mask_utils import CompactMask
+from sam_model import cli_config_path, load_cli_predictor, predict_objects
+from yolo_io import DETECT, SEGMENT, mask_to_yolo_line, write_classes_file, write_label_file
+
+# 支持的图片扩展名，与界面的目录加载一致
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif']
+
+
+def list_images(image_dir):
+    """按文件名排序列出目录中的图片"""
+    return [
+        os.path.join(image_dir, filename)
+        for filename in sorted(os.listdir(image_dir))
+        if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+    ]
+
+
+def read_ahead(items, read):
+    """按顺序读取 items，后台线程预先读取下一项，与当前项的处理重叠
+
+    逐项生成 (item, 读取结果, 异常)，读取出错时结果为None。
+    """
+    items = list(items)
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(read, items[0])
+        for index, item in enumerate(items):
+            try:
+                result, error = pending.result(), None
+            except Exception as e:
+                result, error = None, e
+            if index + 1 < len(items):
+                pending = executor.submit(read, items[index + 1])
+            yield item, result, error
+
+
+def load_prompts(prompt_path):
+    """读取提示文件
+
+    格式为JSON，可以是目标列表，也可以是 {"objects": [...]}。每个目标包含：
+      class_id: 类别ID（默认0）
+      points:   [[x, y], ...] 锚点像素坐标（可选）
+      labels:   [1, 0, ...]   与points对应，1为正点，0为负点（默认全部为正点）
+      box:      [x0, y0, x1, y1] 矩形框提示（可选）
+    """
+    with open(prompt_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    objects = data['objects'] if isinstance(data, dict) else data
+
+    prompts = []
+    for obj in objects:
+        points = obj.get('points')
+        box = obj.get('box')
+        if not points and box is None:
+            continue
+        labels = obj.get('labels') or ([1] * len(points) if points else None)
+        prompts.append({
+            'class_id': int(obj.get('class_id', 0)),
+            'points': np.array(points, dtype=np.float32) if points else None,
+            'labels': np.array(labels, dtype=np.int32) if points else None,
+            'box': np.array(box, dtype=np.float32) if box is not None else None,
+        })
+    return prompts
+
+
+def _read_job(job):
+    """读取一张图片及其提示（在线程池中执行，与模型推理重叠）"""
+    image_path, prompt_path, _ = job
+    image = np.array(Image.open(image_path).convert("RGB"))
+    return image, load_prompts(prompt_path)
+
+
+def _read_batch(batch):
+    """读取一批图片，出错的图片为None，只跳过出错的图片"""
+    loaded = []
+    for job in batch:
+        try:
+            loaded.append(_read_job(job))
+        except Exception as e:
+            loaded.append(None)
+            print(f"读取图片 {os.path.basename(job[0])} 时出错: {str(e)}", file=sys.stderr)
+    return loaded
+
+
+def segment_batch(predictor, images, prompts_list):
+    """批量推理：一次编码多张图片，每张图片的所有目标在一次解码器调用中完成
+
+    返回每张图片的 CompactMask 列表，与 prompts_list 一一对应。
+    """
+    if len(images) == 1:
+        predictor.set_image(images[0])
+    else:
+        predictor.set_image_batch(images)
+    results = []
+    for img_idx, prompts in enumerate(prompts_list):
+        if not prompts:
+            results.append([])
+            continue
+        masks, _ = predict_objects(predictor, prompts, img_idx=img_idx if len(images) > 1 else -1)
+        results.append([CompactMask.from_dense(mask) for mask in masks])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SAM2 无界面批量分割：根据提示文件生成YOLO格式标签")
+    parser.add_argument("--checkpoint", required=True, help="模型文件(.pt)")
+    parser.add_argument("--config", help="模型配置文件，默认根据模型文件名自动选择")
+    parser.add_argument("--images", required=True, help="图片目录")
+    parser.add_argument("--prompts", required=True, help="提示文件目录，每张图片对应一个 <图片名>.json")
+    parser.add_argument("--output", required=True, help="标签输出目录")
+    parser.add_argument("--format", choices=["seg", "det"], default="seg", help="seg: 分割标签，det: 检测标签")
+    parser.add_argument("--classes", help="逗号分隔的类别名称，按顺序对应类别ID，写入classes.txt")
+    parser.add_argument("--device", help="运行设备，例如 cpu 或 cuda，默认自动选择")
+    parser.add_argument("--overwrite", action="store_true", help="重新处理已有标签的图片（默认跳过，用于断点续跑）")
+    parser.add_argument("--batch-size", type=int, default=4, help="每次送入图像编码器的图片数量")
+    args = parser.parse_args(argv)
+
+    dataset_type = SEGMENT if args.format == "seg" else DETECT
+    os.makedirs(args.output, exist_ok=True)
+
+    # 收集需要处理的图片：有提示文件，且（未开启覆盖时）还没有输出标签
+    jobs = []
+    skipped = 0
+    for image_path in list_images(args.images):
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        prompt_path = os.path.join(args.prompts, f"{stem}.json")
+        label_path = os.path.join(args.output, f"{stem}.txt")
+        if not os.path.exists(prompt_path):
+            continue
+        if os.path.exists(label_path) and not args.overwrite:
+            skipped += 1
+            continue
+        jobs.append((image_path, prompt_path, label_path))
+    print(f"待处理图片 {len(jobs)} 张，已跳过 {skipped} 张已有标签的图片")
+
+    if args.classes:
+        class_names = [name.strip() for name in args.classes.split(",") if name.strip()]
+        write_classes_file(os.path.join(args.output, "classes.txt"), class_names,
+                           {name: i for i, name in enumerate(class_names)})
+    if not jobs:
+        return 0
+
+    # 加载模型，与界面中的加载逻辑一致
+    predictor = load_cli_predictor(args.checkpoint, cli_config_path(args.checkpoint, args.config), args.device)
+
+    batch_size = max(1, args.batch_size)
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+    start = time.perf_counter()
+    done = 0
+    failed = 0
+    # 后台线程预先读取下一批图片，与当前批次的推理重叠
+    for batch_index, (batch, loaded, _) in enumerate(read_ahead(batches, _read_batch)):
+        valid = [(job, item) for job, item in zip(batch, loaded) if item is not None]
+        failed += len(batch) - len(valid)
+        try:
+            results = segment_batch(predictor, [item[0] for _, item in valid], [item[1] for _, item in valid]) if valid else []
+        except Exception as e:
+            failed += len(valid)
+            valid, results = [], []
+            print(f"批次 {batch_index + 1} 推理出错: {str(e)}", file=sys.stderr)
+
+        for ((image_path, _, label_path), (image, prompts)), masks in zip(valid, results):
+            img_height, img_width = image.shape[:2]
+            lines = []
+            for prompt, mask in zip(prompts, masks):
+                line = mask_to_yolo_line(mask, prompt['class_id'], img_width, img_height, dataset_type)
+                if line is not None:
+                    lines.append(line)
+            # 标签文件原子写入，中断后重新运行会从未完成的图片继续
+            write_label_file(label_path, lines)
+
+        done += len(batch)
+        elapsed = time.perf_counter() - start
+        speed = done / elapsed if elapsed > 0 else 0.0
+        eta = (len(jobs) - done) / speed if speed > 0 else 0.0
+        print(f"[{done}/{len(jobs)}] {os.path.basename(batch[-1][0])}  {speed:.2f} 张/秒  剩余约 {eta:.0f} 秒", flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"完成：处理 {len(jobs) - failed} 张，失败 {failed} 张，用时 {elapsed:.1f} 秒，"
+          f"平均 {len(jobs) / elapsed:.2f} 张/秒")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
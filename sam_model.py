@@ -0,0 +1,207 @@
+import contextlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+# 配置文件的选择不依赖 torch，放在 app_config 中，界面线程可以直接使用
+from app_config import CONFIG_BY_KEYWORD, DEFAULT_CONFIG, resolve_config_path  # noqa: F401
+
+# 模型注册表中常驻模型的默认内存上限（字节）
+MODEL_MEMORY_BYTES = 4 * 1024 ** 3
+# CPU 推理配置：default 为 PyTorch 默认设置；
+# fast 同时启用 inference_mode、bfloat16 自动混合精度和 channels_last 内存布局；
+# int8 使用动态 int8 量化的模型（见 sam_quantize.py），在 inference_mode 中推理
+CPU_PROFILES = ("default", "fast", "int8")
+
+
+def default_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_predictor(checkpoint_path, config_path, device=None):
+    """构建SAM2模型及其图像预测器，返回 (model, predictor)"""
+    if device is None:
+        device = default_device()
+    model = build_sam2(config_path, checkpoint_path, device=device)
+    predictor = SAM2ImagePredictor(model)
+    return model, predictor
+
+
+def cli_config_path(checkpoint_path, config_path=None):
+    """命令行工具使用的配置文件：未指定时根据模型文件名选择"""
+    if config_path is None:
+        config_path, recognized = resolve_config_path(checkpoint_path)
+        if not recognized:
+            print("未识别的模型类型，使用默认配置")
+    return config_path
+
+
+def load_cli_predictor(checkpoint_path, config_path, device=None):
+    """命令行工具加载模型并打印所用设备，返回 predictor"""
+    device = device or default_device()
+    _, predictor = load_predictor(checkpoint_path, config_path, device)
+    print(f"已加载模型: {os.path.basename(checkpoint_path)} ({device})")
+    return predictor
+
+
+def model_nbytes(model):
+    """模型权重占用的字节数（按 state_dict 统计，量化模型的打包权重也计算在内）"""
+    def nbytes(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(nbytes(v) for v in value)
+        return 0
+    return sum(nbytes(value) for value in model.state_dict().values())
+
+
+def apply_cpu_profile(model, predictor, profile="default", num_threads=None):
+    """对 CPU 上的模型应用推理配置，之后的推理需在 inference_context(predictor) 中进行
+
+    num_threads 设置 PyTorch 的 intra-op 线程数（进程内全局生效）。
+    int8 配置只用于 sam_quantize.load_int8_predictor 加载的量化模型。
+    """
+    if profile not in CPU_PROFILES:
+        raise ValueError(f"未知的CPU推理配置: {profile}")
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if predictor.device.type != "cpu":
+        return
+    if profile == "fast":
+        # 图像编码器中的卷积在 channels_last 布局下使用更快的 oneDNN 实现
+        model.to(memory_format=torch.channels_last)
+    predictor.cpu_profile = profile
+
+
+def inference_context(predictor):
+    """返回推理时使用的上下文：fast 配置下为 inference_mode + bfloat16 autocast，int8 配置下为 inference_mode"""
+    stack = contextlib.ExitStack()
+    profile = getattr(predictor, 'cpu_profile', "default")
+    if profile in ("fast", "int8"):
+        stack.enter_context(torch.inference_mode())
+    # 量化的 Linear 层只接受 float32 输入，int8 配置不使用 autocast
+    if profile == "fast":
+        stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+    return stack
+
+
+def warm_up(predictor, size=256):
+    """用一张空白图片运行一次编码和解码，把首次推理的初始化开销提前到加载阶段"""
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+    with inference_context(predictor):
+        predictor.set_image(image)
+        predictor.predict(point_coords=np.array([[size / 2, size / 2]]), point_labels=np.array([1]))
+    predictor.reset_predictor()
+
+
+class ModelRegistry:
+    """最近使用的模型常驻内存，切换回来时不需要重新加载
+
+    常驻模型的总大小超过 max_bytes 时卸载最久未使用的模型（至少保留最近一个）。
+    get 可以在后台线程中调用。
+    """
+
+    def __init__(self, max_bytes=MODEL_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # (模型文件, 配置文件, 设备, CPU推理配置) -> (model, predictor, nbytes)
+        self._lock = threading.Lock()
+
+    def get(self, checkpoint_path, config_path, device=None, warmup=False, progress=None,
+            cpu_profile="default", num_threads=None):
+        """返回 (model, predictor)，没有常驻时加载；progress(阶段说明) 报告加载进度
+
+        cpu_profile / num_threads 见 apply_cpu_profile，更换配置需要重新加载模型。
+        """
+        if device is None:
+            device = default_device()
+        key = (os.path.abspath(checkpoint_path), config_path, str(device), cpu_profile)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0], entry[1]
+
+        if cpu_profile == "int8":
+            # 只在使用 int8 配置时导入；校验未通过时返回浮点模型，predictor.cpu_profile 为实际使用的配置
+            from sam_quantize import load_int8_predictor
+            model, predictor = load_int8_predictor(checkpoint_path, config_path, device, progress=progress)
+            apply_cpu_profile(model, predictor, predictor.cpu_profile, num_threads)
+        else:
+            if progress is not None:
+                progress("读取权重并构建模型")
+            model, predictor = load_predictor(checkpoint_path, config_path, device)
+            apply_cpu_profile(model, predictor, cpu_profile, num_threads)
+        if warmup:
+            if progress is not None:
+                progress("预热")
+            warm_up(predictor)
+
+        nbytes = model_nbytes(model)
+        with self._lock:
+            self._entries[key] = (model, predictor, nbytes)
+            self.current_bytes += nbytes
+            evicted = False
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                evicted = True
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return model, predictor
+
+
+def _num_points(prompt):
+    return len(prompt['points']) if prompt['points'] is not None else 0
+
+
+def _group_prompts(prompts):
+    """按（是否带框，锚点数量）分组，同组目标的提示形状相同，可以直接堆叠
+
+    不用-1标签把锚点补齐到相同数量：补齐的点仍会进入提示编码器，得到的掩码与单独解码不一致。
+    """
+    groups = {}
+    for i, prompt in enumerate(prompts):
+        groups.setdefault((prompt['box'] is not None, _num_points(prompt)), []).append(i)
+    return list(groups.values())
+
+
+@torch.no_grad()
+def predict_objects(predictor, prompts, img_idx=-1, multimask_output=True):
+    """在一次提示/掩码解码器调用中预测多个目标
+
+    prompts 中每个目标包含 points (N×2)、labels (N)、box (4) 中的任意组合（没有的为None）。
+    带框与否、锚点数量都相同的目标为一组，每组一次解码，结果与逐个调用 predictor.predict 一致。
+    img_idx 用于 set_image_batch 之后的批量模式。
+    返回与 prompts 顺序一致的 (masks, scores)，masks 为每个目标得分最高的掩码 (H×W bool)。
+    """
+    masks = [None] * len(prompts)
+    scores = [None] * len(prompts)
+    for indices in _group_prompts(prompts):
+        group = [prompts[i] for i in indices]
+        if _num_points(group[0]):
+            point_coords = np.stack([np.asarray(p['points'], dtype=np.float32) for p in group])
+            point_labels = np.stack([np.asarray(p['labels'], dtype=np.int32) for p in group])
+        else:
+            point_coords, point_labels = None, None
+        box = np.stack([p['box'] for p in group]) if group[0]['box'] is not None else None
+        _, unnorm_coords, labels, unnorm_box = predictor._prep_prompts(
+            point_coords, point_labels, box, None, True, img_idx=img_idx
+        )
+        group_masks, group_scores, _ = predictor._predict(
+            unnorm_coords, labels, unnorm_box, None, multimask_output, img_idx=img_idx
+        )
+        # 每个目标取得分最高的候选掩码
+        best = group_scores.argmax(dim=1)
+        rows = torch.arange(len(group), device=best.device)
+        group_masks = group_masks[rows, best].cpu().numpy()
+        group_scores = group_scores[rows, best].float().cpu().numpy()
+        for j, i in enumerate(indices):
+            masks[i] = group_masks[j]
+            scores[i] = float(group_scores[j])
+    return masks, scores
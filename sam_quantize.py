@@ -0,0 +1,142 @@
+import copy
+import os
+
+import numpy as np
+import cv2
+import torch
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+from feature_cache import apply_features, encode_image
+from sam_model import inference_context, load_predictor
+
+# int8 模型与浮点模型在校验图片上的平均掩码 IoU 下限，低于该值时继续使用浮点模型
+MIN_MASK_IOU = 0.9
+# 量化后的权重缓存在模型文件旁，文件名为 <模型文件>.int8.pt
+CACHE_SUFFIX = ".int8.pt"
+CACHE_VERSION = 1
+
+
+def quantize_model(model):
+    """动态 int8 量化：图像编码器（Hiera）和掩码解码器中的全部 Linear 层，权重 int8，激活在运行时量化"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def validation_images(size=512):
+    """生成固定的校验图片：渐变背景上的若干彩色几何图形，离线可用"""
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(2):
+        ramp = np.linspace(40, 200, size, dtype=np.float32)
+        image = np.stack([np.add.outer(ramp, ramp) / 2] * 3, axis=-1).astype(np.uint8)
+        for _ in range(6):
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            center = tuple(int(c) for c in rng.integers(size // 8, size * 7 // 8, 2))
+            if rng.random() < 0.5:
+                axes = tuple(int(a) for a in rng.integers(size // 16, size // 5, 2))
+                cv2.ellipse(image, center, axes, int(rng.integers(0, 180)), 0, 360, color, -1)
+            else:
+                half = rng.integers(size // 16, size // 5, 2)
+                cv2.rectangle(image, (int(center[0] - half[0]), int(center[1] - half[1])),
+                              (int(center[0] + half[0]), int(center[1] + half[1])), color, -1)
+        images.append(image)
+    return images
+
+
+def mask_agreement(reference, candidate, images, points_per_side=4):
+    """两个 predictor 在网格单点提示下得分最高掩码的平均 IoU"""
+    ious = []
+    for image in images:
+        h, w = image.shape[:2]
+        offsets = (np.arange(points_per_side) + 0.5) / points_per_side
+        points = [(x * w, y * h) for y in offsets for x in offsets]
+        results = []
+        for predictor in (reference, candidate):
+            apply_features(predictor, encode_image(predictor, image))
+            masks = []
+            with inference_context(predictor):
+                for point in points:
+                    pred_masks, scores, _ = predictor.predict(point_coords=np.array([point]),
+                                                              point_labels=np.array([1]))
+                    masks.append(pred_masks[np.argmax(scores)] > 0)
+            predictor.reset_predictor()
+            results.append(masks)
+        for a, b in zip(*results):
+            union = np.count_nonzero(a | b)
+            ious.append(np.count_nonzero(a & b) / union if union else 1.0)
+    return float(np.mean(ious))
+
+
+def _cache_meta(checkpoint_path, config_path):
+    """缓存的有效条件：模型文件、配置和 PyTorch 版本都未变化"""
+    stat = os.stat(checkpoint_path)
+    return {
+        'version': CACHE_VERSION,
+        'checkpoint_size': stat.st_size,
+        'checkpoint_mtime_ns': stat.st_mtime_ns,
+        'config': os.path.basename(config_path),
+        'torch': str(torch.__version__),
+    }
+
+
+def _load_cache(cache_path, meta):
+    try:
+        cache = torch.load(cache_path, map_location="cpu")
+    except Exception:
+        return None
+    if not isinstance(cache, dict) or cache.get('meta') != meta:
+        return None
+    return cache
+
+
+def load_int8_predictor(checkpoint_path, config_path, device="cpu", min_iou=MIN_MASK_IOU, cache_path=None,
+                        progress=None):
+    """加载 int8 动态量化的模型，返回 (model, predictor)
+
+    第一次使用时量化浮点模型，并在校验图片上与浮点模型比较掩码 IoU，
+    通过校验后把量化权重缓存到磁盘；之后直接构建量化结构并读取缓存，不再读取浮点权重。
+    校验未通过或设备不是 CPU 时返回浮点模型。返回的 predictor.cpu_profile 为实际使用的配置。
+    """
+    if torch.device(device).type != "cpu":
+        model, predictor = load_predictor(checkpoint_path, config_path, device)
+        predictor.cpu_profile = "default"
+        return model, predictor
+
+    cache_path = cache_path or f"{checkpoint_path}{CACHE_SUFFIX}"
+    meta = _cache_meta(checkpoint_path, config_path)
+    cache = _load_cache(cache_path, meta)
+    if cache is not None:
+        if progress is not None:
+            progress("读取int8模型缓存")
+        model = quantize_model(build_sam2(config_path, None, device="cpu"))
+        model.load_state_dict(cache['state_dict'])
+        model.eval()
+        predictor = SAM2ImagePredictor(model)
+        predictor.cpu_profile = "int8"
+        return model, predictor
+
+    if progress is not None:
+        progress("读取权重并构建模型")
+    float_model, float_predictor = load_predictor(checkpoint_path, config_path, "cpu")
+    if progress is not None:
+        progress("int8量化")
+    model = quantize_model(copy.deepcopy(float_model))
+    predictor = SAM2ImagePredictor(model)
+    predictor.cpu_profile = "int8"
+
+    if progress is not None:
+        progress("校验int8模型")
+    iou = mask_agreement(float_predictor, predictor, validation_images())
+    if iou < min_iou:
+        print(f"int8模型与浮点模型的平均掩码IoU为 {iou:.3f}，低于 {min_iou}，使用浮点模型")
+        float_predictor.cpu_profile = "default"
+        return float_model, float_predictor
+
+    try:
+        tmp_path = f"{cache_path}.tmp"
+        torch.save({'meta': meta, 'iou': iou, 'state_dict': model.state_dict()}, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        # 模型目录不可写时只是不缓存
+        print(f"保存int8模型缓存时出错: {str(e)}")
+    return model, predictor
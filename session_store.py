@@ -0,0 +1,200 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+def _array_nbytes(value):
+    if value is None:
+        return 0
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sum(_array_nbytes(v) for v in value)
+
+
+def result_nbytes(result):
+    """估算一条分割结果（候选掩码、得分、logits）占用的字节数"""
+    return sum(_array_nbytes(result.get(key)) for key in ('masks', 'scores', 'logits'))
+
+
+def annotations_nbytes(annotations):
+    """估算一张图片的标注列表占用的字节数"""
+    # 每个标注额外按256字节估算字典和类别信息的开销
+    return sum(_array_nbytes(a.get('mask')) + 256 for a in annotations)
+
+
+def annotations_digest(annotations):
+    """计算标注内容（类别ID和掩码）的哈希值，用于判断导出结果是否需要更新"""
+    digest = hashlib.sha1()
+    for annotation in annotations:
+        mask = annotation['mask']
+        digest.update(repr((annotation['class_id'], mask.shape, mask.bbox)).encode())
+        digest.update(mask.fingerprint())
+    return digest.hexdigest()
+
+
+class ResultCache(MutableMapping):
+    """每张图片的分割结果缓存，超出字节预算时淘汰最久未访问的结果"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # path -> (result, nbytes)
+
+    def __getitem__(self, path):
+        result = self._entries[path][0]
+        self._entries.move_to_end(path)
+        return result
+
+    def __setitem__(self, path, result):
+        if path in self._entries:
+            del self[path]
+        nbytes = result_nbytes(result)
+        self._entries[path] = (result, nbytes)
+        self.current_bytes += nbytes
+        # 从最久未使用的结果开始淘汰，至少保留刚写入的这一条
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+
+    def __delitem__(self, path):
+        self.current_bytes -= self._entries.pop(path)[1]
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AnnotationStore(MutableMapping):
+    """每张图片的标注存储
+
+    内存中的标注超出字节预算时，把最久未访问图片的标注写入磁盘临时目录，
+    再次访问时自动读回，对调用方透明。pin 指定的图片（当前显示的图片）不会被写出。
+
+    标注列表会被界面原地修改，修改后需调用 mark_dirty，digest 才会重新计算。
+    """
+
+    def __init__(self, max_bytes, spill_dir=None):
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()  # path -> 标注列表
+        self._sizes = {}  # path -> 写入时估算的字节数
+        self._memory_bytes = 0  # _sizes 的总和
+        self._spilled = {}  # path -> (磁盘文件, 标注数量)
+        self._pinned = None
+        self._next_file = 0
+        self._digests = {}  # path -> 标注内容哈希，mark_dirty 后失效
+        if spill_dir is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="sam_annotations_")
+            spill_dir = self._tmpdir.name
+        self.spill_dir = spill_dir
+
+    def pin(self, path):
+        """固定当前图片的标注，使其始终留在内存中"""
+        self._pinned = path
+        self._evict()
+
+    def mark_dirty(self, path):
+        """标记某张图片的标注已被修改"""
+        self._digests.pop(path, None)
+
+    def is_dirty(self, path):
+        return path not in self._digests
+
+    def digest(self, path):
+        """返回标注内容的哈希值，未修改的图片直接使用缓存，不会从磁盘读回"""
+        if path not in self._digests:
+            self._digests[path] = annotations_digest(self.peek(path))
+        return self._digests[path]
+
+    def __getitem__(self, path):
+        if path in self._memory:
+            self._memory.move_to_end(path)
+            return self._memory[path]
+        annotations = self.peek(path)
+        # 读回内存并删除磁盘文件
+        os.remove(self._spilled.pop(path)[0])
+        self._memory[path] = annotations
+        self._set_size(path, annotations_nbytes(annotations))
+        self._evict()
+        return annotations
+
+    def peek(self, path):
+        """读取标注但不改变内存中的缓存状态（适合批量导出时顺序遍历）"""
+        if path in self._memory:
+            return self._memory[path]
+        if path not in self._spilled:
+            raise KeyError(path)
+        with open(self._spilled[path][0], 'rb') as f:
+            return pickle.load(f)
+
+    def __setitem__(self, path, annotations):
+        self.mark_dirty(path)
+        if path in self._spilled:
+            os.remove(self._spilled.pop(path)[0])
+        self._memory[path] = annotations
+        self._memory.move_to_end(path)
+        self._set_size(path, annotations_nbytes(annotations))
+        self._evict()
+
+    def __delitem__(self, path):
+        self.mark_dirty(path)
+        if path in self._memory:
+            del self._memory[path]
+            self._memory_bytes -= self._sizes.pop(path)
+        else:
+            os.remove(self._spilled.pop(path)[0])
+
+    def __contains__(self, path):
+        return path in self._memory or path in self._spilled
+
+    def __iter__(self):
+        return iter(list(self._memory) + list(self._spilled))
+
+    def __len__(self):
+        return len(self._memory) + len(self._spilled)
+
+    def count(self, path):
+        """返回某张图片的标注数量，不会从磁盘读回"""
+        if path in self._memory:
+            return len(self._memory[path])
+        if path in self._spilled:
+            return self._spilled[path][1]
+        return 0
+
+    def has_annotations(self):
+        """是否有任意图片存在标注"""
+        return any(self.count(path) > 0 for path in self)
+
+    def _set_size(self, path, nbytes):
+        self._memory_bytes += nbytes - self._sizes.get(path, 0)
+        self._sizes[path] = nbytes
+
+    def _evict(self):
+        # 当前图片的标注可能被原地修改，重新估算其大小
+        if self._pinned in self._memory:
+            self._set_size(self._pinned, annotations_nbytes(self._memory[self._pinned]))
+        if self._memory_bytes <= self.max_bytes:
+            return
+        for path in list(self._memory):
+            if self._memory_bytes <= self.max_bytes:
+                break
+            if path == self._pinned:
+                continue
+            self._spill(path)
+
+    def _spill(self, path):
+        annotations = self._memory.pop(path)
+        nbytes = self._sizes.pop(path)
+        self._memory_bytes -= nbytes
+        file_path = os.path.join(self.spill_dir, f"{self._next_file}.pkl")
+        self._next_file += 1
+        with open(file_path, 'wb') as f:
+            pickle.dump(annotations, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spilled[path] = (file_path, len(annotations))
@@ -0,0 +1,144 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from mask_utils import CompactMask, MaskHitIndex, PolygonMask, as_dense, mask_region
+
+
+def random_masks(rng, count, shape=(60, 80)):
+    """生成若干相互重叠的随机矩形/圆形掩码"""
+    height, width = shape
+    yy, xx = np.mgrid[:height, :width]
+    masks = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            x0, y0 = rng.integers(0, width - 5), rng.integers(0, height - 5)
+            x1, y1 = rng.integers(x0 + 1, width + 1), rng.integers(y0 + 1, height + 1)
+            mask = np.zeros(shape, dtype=bool)
+            mask[y0:y1, x0:x1] = True
+        else:
+            cx, cy, r = rng.integers(0, width), rng.integers(0, height), rng.integers(2, 20)
+            mask = (xx - cx) ** 2 + (yy - cy) ** 2 <= r * r
+        masks.append(mask)
+    return masks
+
+
+def brute_force_hit(masks, x, y):
+    """逐个检查掩码，返回第一个覆盖 (x, y) 的标注序号"""
+    for i, mask in enumerate(masks):
+        if as_dense(mask)[y, x]:
+            return i
+    return -1
+
+
+def assert_index_matches(index, masks):
+    height, width = index.shape
+    expected = np.full((height, width), -1)
+    for i in range(len(masks) - 1, -1, -1):
+        expected[as_dense(masks[i])] = i
+    actual = index.label_map.astype(np.int64) - 1
+    assert np.array_equal(actual, expected)
+    for x, y in [(0, 0), (width - 1, height - 1), (width // 2, height // 2)]:
+        assert index.hit(x, y) == brute_force_hit(masks, x, y)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compact_mask_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    for dense in random_masks(rng, 8):
+        compact = CompactMask.from_dense(dense)
+        assert np.array_equal(compact.to_dense(), dense)
+        assert compact.area == dense.sum()
+        assert np.array_equal(np.asarray(compact), dense)
+        region = (5, 7, 50, 40)
+        assert np.array_equal(mask_region(compact, region, dense.shape), dense[7:40, 5:50])
+
+
+def test_compact_mask_empty_and_box():
+    empty = CompactMask.from_dense(np.zeros((10, 12), dtype=bool))
+    assert empty.bbox is None
+    assert empty.area == 0
+    assert not empty.to_dense().any()
+    assert empty.centroid() is None
+
+    box = CompactMask.from_box(2, 3, 6, 8, (10, 12))
+    expected = np.zeros((10, 12), dtype=bool)
+    expected[3:9, 2:7] = True  # 与 cv2.rectangle 一样包含右下角
+    assert np.array_equal(box.to_dense(), expected)
+
+
+def test_compact_mask_accepts_channel_dimension():
+    dense = np.zeros((1, 20, 30), dtype=np.float32)
+    dense[0, 4:9, 10:15] = 1.0
+    compact = CompactMask.from_dense(dense)
+    assert compact.shape == (20, 30)
+    assert compact.bbox == (10, 4, 15, 9)
+    assert np.array_equal(compact.to_dense(), dense[0] > 0.5)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("compact", [False, True])
+def test_hit_index_matches_brute_force(seed, compact):
+    rng = np.random.default_rng(seed)
+    masks = random_masks(rng, 12)
+    if compact:
+        masks = [CompactMask.from_dense(mask) for mask in masks]
+    index = MaskHitIndex(60, 80)
+
+    for mask in masks[:8]:
+        index.append(mask)
+    current = list(masks[:8])
+    assert_index_matches(index, current)
+
+    # 交替删除与追加，每一步都与逐个检查的结果一致
+    for mask in masks[8:]:
+        removed = int(rng.integers(0, len(current)))
+        del current[removed]
+        index.remove(removed, current)
+        assert_index_matches(index, current)
+        current.append(mask)
+        index.append(mask)
+        assert_index_matches(index, current)
+
+    rebuilt = MaskHitIndex(60, 80)
+    rebuilt.rebuild(current)
+    assert np.array_equal(rebuilt.label_map, index.label_map)
+    assert rebuilt.bboxes == index.bboxes
+
+
+def test_hit_index_remove_empty_mask():
+    full = np.ones((10, 10), dtype=bool)
+    masks = [np.zeros((10, 10), dtype=bool), full]
+    index = MaskHitIndex(10, 10)
+    index.rebuild(masks)
+    assert index.hit(3, 3) == 1
+    del masks[0]
+    index.remove(0, masks)
+    assert index.hit(3, 3) == 0
+    assert len(index) == 1
+
+
+def test_polygon_mask_matches_rasterized_polygon():
+    points = [(5.7, 3.2), (40.1, 8.9), (33.5, 35.0), (9.0, 28.4)]
+    polygon = PolygonMask(points, (40, 50))
+    compact = CompactMask.from_polygon(points, (40, 50))
+    assert polygon.bbox == compact.bbox
+    assert np.array_equal(polygon.to_dense(), compact.to_dense())
+    assert polygon.area == compact.area
+    assert np.array_equal(polygon.vectorize(), np.asarray(points))
+
+    # 全分辨率渲染与栅格化结果一致
+    rendered = polygon.render((0, 0, 50, 40), (50, 40))
+    assert np.array_equal(rendered > 0, compact.to_dense())
+
+    restored = pickle.loads(pickle.dumps(polygon))
+    assert restored._render_cache is None
+    assert np.array_equal(restored.to_dense(), polygon.to_dense())
+
+
+def test_polygon_mask_from_box_keeps_original_box():
+    box = (10.5, 8.0, 9.0, 6.0)
+    mask = PolygonMask.from_box(6, 5, 15, 11, (20, 30), box)
+    assert mask.box == box
+    assert np.array_equal(mask.to_dense(), CompactMask.from_box(6, 5, 15, 11, (20, 30)).to_dense())
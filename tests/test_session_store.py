@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+
+from mask_utils import CompactMask
+from session_store import AnnotationStore, ResultCache, annotations_nbytes
+
+
+def make_annotations(seed, count=3, shape=(40, 50)):
+    rng = np.random.default_rng(seed)
+    annotations = []
+    for i in range(count):
+        dense = rng.random(shape) > 0.5
+        annotations.append({
+            'mask': CompactMask.from_dense(dense),
+            'class_id': i % 2,
+            'class_name': f"c{i % 2}",
+            'mask_id': i,
+        })
+    return annotations
+
+
+def same_annotations(a, b):
+    return len(a) == len(b) and all(
+        x['class_id'] == y['class_id'] and np.array_equal(x['mask'].to_dense(), y['mask'].to_dense())
+        for x, y in zip(a, b)
+    )
+
+
+def spill_files(store):
+    return os.listdir(store.spill_dir)
+
+
+def test_spill_and_read_back(tmp_path):
+    entries = {f"img{i}.jpg": make_annotations(i) for i in range(6)}
+    # 预算只够放下两张图片的标注
+    budget = 2 * annotations_nbytes(entries["img0.jpg"])
+    store = AnnotationStore(budget, spill_dir=str(tmp_path))
+    for path, annotations in entries.items():
+        store[path] = annotations
+
+    assert len(store) == 6
+    assert set(store) == set(entries)
+    assert 0 < len(spill_files(store)) <= 4
+    # 数量不需要从磁盘读回
+    for path, annotations in entries.items():
+        assert store.count(path) == len(annotations)
+    assert store.has_annotations()
+
+    # peek 读取已写出的标注但不读回内存
+    files_before = len(spill_files(store))
+    assert same_annotations(store.peek("img0.jpg"), entries["img0.jpg"])
+    assert len(spill_files(store)) == files_before
+
+    # 下标访问读回内存并删除磁盘文件，其他图片按LRU写出
+    for path, annotations in entries.items():
+        assert same_annotations(store[path], annotations)
+    assert len(store) == 6
+    assert len(spill_files(store)) == 4
+
+
+def test_pinned_image_stays_in_memory(tmp_path):
+    entries = {f"img{i}.jpg": make_annotations(i) for i in range(4)}
+    store = AnnotationStore(annotations_nbytes(entries["img0.jpg"]), spill_dir=str(tmp_path))
+    current = entries["img0.jpg"]
+    store["img0.jpg"] = current
+    store.pin("img0.jpg")
+    for path in ("img1.jpg", "img2.jpg", "img3.jpg"):
+        store[path] = entries[path]
+    # 当前图片的列表被原地修改后仍是同一个对象
+    current.extend(make_annotations(9, count=2))
+    store.pin("img0.jpg")
+    assert store["img0.jpg"] is current
+    assert store.count("img0.jpg") == 5
+
+
+def test_delete_spilled_entry(tmp_path):
+    store = AnnotationStore(0, spill_dir=str(tmp_path))
+    store["a.jpg"] = make_annotations(1)
+    store["b.jpg"] = make_annotations(2)
+    assert spill_files(store)
+    del store["a.jpg"]
+    del store["b.jpg"]
+    assert len(store) == 0
+    assert spill_files(store) == []
+    assert not store.has_annotations()
+
+
+def test_digest_tracks_dirty_state(tmp_path):
+    store = AnnotationStore(0, spill_dir=str(tmp_path))
+    annotations = make_annotations(3)
+    store["a.jpg"] = annotations
+    assert store.is_dirty("a.jpg")
+
+    digest = store.digest("a.jpg")
+    assert not store.is_dirty("a.jpg")
+    # 已写出的图片再次计算时直接使用缓存
+    assert store.digest("a.jpg") == digest
+
+    # 当前图片的列表被原地修改后需要 mark_dirty 才会重新计算
+    store.pin("a.jpg")
+    current = store["a.jpg"]
+    current[0]['class_id'] = 7
+    assert store.digest("a.jpg") == digest
+    store.mark_dirty("a.jpg")
+    assert store.is_dirty("a.jpg")
+    changed = store.digest("a.jpg")
+    assert changed != digest
+
+    # 重新写入同样的内容时哈希不变
+    store["b.jpg"] = [dict(a) for a in current]
+    assert store.is_dirty("b.jpg")
+    assert store.digest("b.jpg") == changed
+
+    del store["a.jpg"]
+    assert store.is_dirty("a.jpg")
+
+
+def test_result_cache_evicts_least_recently_used():
+    mask = np.zeros((3, 10, 10), dtype=np.float32)
+    entry_bytes = mask.nbytes + 12
+    cache = ResultCache(2 * entry_bytes)
+    for path in ("a", "b"):
+        cache[path] = {'masks': mask, 'scores': np.zeros(3, dtype=np.float32)}
+    cache["a"]  # 访问后 b 成为最久未使用
+    cache["c"] = {'masks': mask, 'scores': np.zeros(3, dtype=np.float32)}
+    assert set(cache) == {"a", "c"}
+    assert cache.current_bytes == 2 * entry_bytes
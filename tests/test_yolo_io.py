@@ -0,0 +1,63 @@
+import numpy as np
+from PIL import Image
+
+from mask_utils import CompactMask, PolygonMask
+from yolo_io import DETECT, SEGMENT, mask_to_yolo_line, parse_label_lines, read_label_file, write_label_file
+
+WIDTH, HEIGHT = 64, 48
+
+
+def rectangle(x0, y0, x1, y1):
+    mask = np.zeros((HEIGHT, WIDTH), dtype=bool)
+    mask[y0:y1, x0:x1] = True
+    return mask
+
+
+def iou(a, b):
+    a, b = np.asarray(a, dtype=bool), np.asarray(b, dtype=bool)
+    return np.count_nonzero(a & b) / max(1, np.count_nonzero(a | b))
+
+
+def test_segment_round_trip_from_dense_mask():
+    dense = rectangle(10, 8, 40, 30)
+    for mask in (dense, CompactMask.from_dense(dense)):
+        line = mask_to_yolo_line(mask, 3, WIDTH, HEIGHT, SEGMENT)
+        [(class_id, parsed)] = parse_label_lines([line], WIDTH, HEIGHT)
+        assert class_id == 3
+        assert isinstance(parsed, PolygonMask)
+        assert iou(parsed.to_dense(), dense) > 0.9
+        # 矢量标注再次导出时原样写出
+        assert mask_to_yolo_line(parsed, 3, WIDTH, HEIGHT, SEGMENT) == line
+
+
+def test_detect_round_trip():
+    dense = rectangle(5, 6, 21, 31)
+    line = mask_to_yolo_line(CompactMask.from_dense(dense), 1, WIDTH, HEIGHT, DETECT)
+    [(class_id, parsed)] = parse_label_lines([line], WIDTH, HEIGHT)
+    assert class_id == 1
+    assert parsed.box is not None
+    # 归一化坐标只保留6位小数，栅格化后的边缘允许相差一个像素
+    assert np.abs(np.subtract(parsed.bbox, (5, 6, 21, 31))).max() <= 1
+    assert iou(parsed.to_dense(), dense) > 0.85
+    assert mask_to_yolo_line(parsed, 1, WIDTH, HEIGHT, DETECT) == line
+
+
+def test_parse_skips_invalid_lines():
+    lines = ["", "0 0.5 0.5", "x 0.1 0.1 0.2 0.2", "0 0.1 0.1 0.9 0.1 0.5", "2 0.5 0.5 0.2 0.2\n"]
+    labels = parse_label_lines(lines, WIDTH, HEIGHT)
+    assert [class_id for class_id, _ in labels] == [2]
+
+
+def test_write_and_read_label_file(tmp_path):
+    image_path = tmp_path / "a.png"
+    Image.new("RGB", (WIDTH, HEIGHT)).save(image_path)
+    masks = [rectangle(2, 2, 20, 20), rectangle(30, 10, 60, 40)]
+    lines = [mask_to_yolo_line(mask, i, WIDTH, HEIGHT, SEGMENT) for i, mask in enumerate(masks)]
+    label_path = tmp_path / "a.txt"
+    write_label_file(str(label_path), lines)
+    assert not (tmp_path / "a.txt.tmp").exists()
+
+    labels = read_label_file(str(label_path), str(image_path))
+    assert [class_id for class_id, _ in labels] == [0, 1]
+    for (_, parsed), mask in zip(labels, masks):
+        assert iou(parsed.to_dense(), mask) > 0.9
@@ -0,0 +1,266 @@
+import os
+os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
+
+import argparse
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from app_config import POINTS_PER_SIDE, TILE_OVERLAP, TILE_SIZE
+from mask_utils import CompactMask
+from sam_batch import list_images, read_ahead
+from sam_model import cli_config_path, load_cli_predictor, predict_objects
+from yolo_io import DETECT, SEGMENT, mask_to_yolo_line, write_label_file
+
+# 每次解码的提示点数量，限制解码器输出的候选掩码占用的内存
+POINTS_PER_BATCH = 32
+
+
+def iter_tiles(height, width, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """按滑动窗口生成分块 (x0, y0, x1, y1)，最后一行/列贴齐图片边缘"""
+    tile_size = max(1, int(tile_size))
+    stride = max(1, tile_size - int(overlap))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size + 1, stride))
+        if positions[-1] + tile_size < length:
+            positions.append(length - tile_size)
+        return positions
+
+    for y0 in starts(height):
+        for x0 in starts(width):
+            yield (x0, y0, min(width, x0 + tile_size), min(height, y0 + tile_size))
+
+
+def grid_points(width, height, points_per_side=POINTS_PER_SIDE):
+    """在分块内均匀分布网格提示点（像素坐标）"""
+    offsets = (np.arange(points_per_side) + 0.5) / points_per_side
+    xs, ys = np.meshgrid(offsets * width, offsets * height)
+    return np.stack([xs.ravel(), ys.ravel()], axis=1).astype(np.float32)
+
+
+def read_tile(image, tile):
+    """读取一个分块：numpy 数组直接切片；PIL 图片只把该分块转换为数组
+
+    PIL 的 crop 会先解码整张图片（load），这里省下的只是整图的 numpy 副本。
+    """
+    x0, y0, x1, y1 = tile
+    if isinstance(image, Image.Image):
+        return np.array(image.crop((x0, y0, x1, y1)).convert("RGB"))
+    return np.ascontiguousarray(image[y0:y1, x0:x1])
+
+
+def image_size(image):
+    """返回图片的 (高, 宽)"""
+    if isinstance(image, Image.Image):
+        return image.height, image.width
+    return image.shape[:2]
+
+
+def default_tile_batch(predictor):
+    """GPU 上一次编码多个分块，CPU 上逐块编码（CPU 的并行由 torch 线程完成）"""
+    return 4 if predictor.device.type == "cuda" else 1
+
+
+def _intersection(a, b):
+    x0, y0, x1, y1 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def _region_iou(a, b, region):
+    """两个掩码在窗口 region 内的 IoU"""
+    mask_a = a.region(*region)
+    mask_b = b.region(*region)
+    union = np.count_nonzero(mask_a | mask_b)
+    if union == 0:
+        return 0.0
+    return np.count_nonzero(mask_a & mask_b) / union
+
+
+def _mask_iou(a, b):
+    """两个紧凑掩码在整图上的 IoU，只在两者外接框的并集内计算"""
+    if _intersection(a.bbox, b.bbox) is None:
+        return 0.0
+    bbox = (min(a.bbox[0], b.bbox[0]), min(a.bbox[1], b.bbox[1]),
+            max(a.bbox[2], b.bbox[2]), max(a.bbox[3], b.bbox[3]))
+    return _region_iou(a, b, bbox)
+
+
+def merge_tile_masks(candidates, nms_iou=0.7, merge_iou=0.5):
+    """按得分从高到低合并各分块的候选掩码
+
+    candidates 中每项为 {'mask': CompactMask(原图坐标), 'score': float, 'tile': (x0, y0, x1, y1)}。
+    同一分块内与已保留掩码 IoU 超过 nms_iou 的候选被抑制（NMS）；
+    来自相邻分块的候选在两块的重叠带内 IoU 超过 merge_iou 时视为同一目标被接缝切开，合并为一个掩码。
+    返回 [{'mask', 'score', 'tiles'}]。
+    """
+    kept = []
+    for cand in sorted(candidates, key=lambda c: c['score'], reverse=True):
+        mask = cand['mask']
+        absorbed = False
+        for item in kept:
+            if _intersection(item['mask'].bbox, mask.bbox) is None:
+                continue
+            if cand['tile'] in item['tiles']:
+                # 同一分块内的重复候选
+                if _mask_iou(item['mask'], mask) > nms_iou:
+                    absorbed = True
+                    break
+                continue
+            # 不同分块：只比较两块重叠带内的部分
+            for tile in item['tiles']:
+                shared = _intersection(tile, cand['tile'])
+                if shared is not None and _region_iou(item['mask'], mask, shared) > merge_iou:
+                    item['mask'] = item['mask'].union(mask)
+                    item['tiles'].append(cand['tile'])
+                    absorbed = True
+                    break
+            if absorbed:
+                break
+        if not absorbed:
+            kept.append({'mask': mask, 'score': cand['score'], 'tiles': [cand['tile']]})
+    return kept
+
+
+def _segment_tile_features(predictor, tile, tile_image_size, shape, img_idx, points_per_side,
+                           points_per_batch, score_threshold, min_area):
+    """对已编码的一个分块用网格提示点解码，返回原图坐标下的候选掩码"""
+    tile_h, tile_w = tile_image_size
+    points = grid_points(tile_w, tile_h, points_per_side)
+    candidates = []
+    for start in range(0, len(points), points_per_batch):
+        prompts = [
+            {'points': point[None], 'labels': np.ones(1, dtype=np.int32), 'box': None}
+            for point in points[start:start + points_per_batch]
+        ]
+        masks, scores = predict_objects(predictor, prompts, img_idx=img_idx)
+        for mask, score in zip(masks, scores):
+            if score < score_threshold:
+                continue
+            compact = CompactMask.from_dense(mask)
+            if compact.bbox is None or compact.area < min_area:
+                continue
+            candidates.append({
+                'mask': compact.translate(tile[0], tile[1], shape),
+                'score': score,
+                'tile': tile,
+            })
+    return candidates
+
+
+def segment_tiles(predictor, image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, points_per_side=POINTS_PER_SIDE,
+                  points_per_batch=POINTS_PER_BATCH, batch_size=None, score_threshold=0.7, min_area=16,
+                  nms_iou=0.7, merge_iou=0.5, progress=None):
+    """分块自动分割超大图片
+
+    每个分块以模型的完整输入分辨率单独编码，用网格提示点得到候选掩码，
+    再通过 NMS 和重叠带合并拼接成整图结果。分块逐批读取和编码，同一时刻只保留一批分块的特征，
+    候选掩码按外接框压缩存储，这两部分的内存不随分块数量增长；但解码后的整张图片仍然保存在内存中
+    （PIL 图片在第一次 crop 时整图解码）。
+    image 可以是 numpy 数组或 PIL 图片；progress(done, total) 在每批分块完成后调用。
+    返回按得分排序的 [{'mask': CompactMask, 'score': float, 'tiles': [...]}]。
+    """
+    shape = image_size(image)
+    tiles = list(iter_tiles(shape[0], shape[1], tile_size, overlap))
+    if batch_size is None:
+        batch_size = default_tile_batch(predictor)
+    batch_size = max(1, batch_size)
+    batches = [tiles[i:i + batch_size] for i in range(0, len(tiles), batch_size)]
+
+    candidates = []
+    done = 0
+    # 后台线程读取下一批分块，与当前批次的推理重叠
+    for batch, tile_images, error in read_ahead(batches, lambda b: [read_tile(image, tile) for tile in b]):
+        if error is not None:
+            raise error
+        if len(tile_images) == 1:
+            predictor.set_image(tile_images[0])
+        else:
+            predictor.set_image_batch(tile_images)
+        for img_idx, (tile, tile_image) in enumerate(zip(batch, tile_images)):
+            candidates.extend(_segment_tile_features(
+                predictor, tile, tile_image.shape[:2], shape, img_idx if len(batch) > 1 else -1,
+                points_per_side, points_per_batch, score_threshold, min_area))
+        del tile_images
+
+        done += len(batch)
+        if progress is not None:
+            progress(done, len(tiles))
+
+    predictor.reset_predictor()
+    return merge_tile_masks(candidates, nms_iou, merge_iou)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SAM2 分块自动分割：适用于航拍、PCB、病理等超大图片，生成YOLO格式标签")
+    parser.add_argument("--checkpoint", required=True, help="模型文件(.pt)")
+    parser.add_argument("--config", help="模型配置文件，默认根据模型文件名自动选择")
+    parser.add_argument("--images", required=True, help="图片目录")
+    parser.add_argument("--output", required=True, help="标签输出目录")
+    parser.add_argument("--format", choices=["seg", "det"], default="seg", help="seg: 分割标签，det: 检测标签")
+    parser.add_argument("--class-id", type=int, default=0, help="所有自动分割目标使用的类别ID")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="分块边长（像素）")
+    parser.add_argument("--overlap", type=int, default=TILE_OVERLAP, help="相邻分块的重叠宽度（像素）")
+    parser.add_argument("--points-per-side", type=int, default=POINTS_PER_SIDE, help="每个分块内网格提示点的每边数量")
+    parser.add_argument("--score-threshold", type=float, default=0.7, help="保留候选掩码的最低得分")
+    parser.add_argument("--tile-batch", type=int, help="每次送入图像编码器的分块数量，默认GPU为4、CPU为1")
+    parser.add_argument("--device", help="运行设备，例如 cpu 或 cuda，默认自动选择")
+    parser.add_argument("--overwrite", action="store_true", help="重新处理已有标签的图片（默认跳过，用于断点续跑）")
+    args = parser.parse_args(argv)
+
+    # 超大图片会触发PIL的解压炸弹保护，这里处理的是可信的本地图片
+    Image.MAX_IMAGE_PIXELS = None
+    dataset_type = SEGMENT if args.format == "seg" else DETECT
+    os.makedirs(args.output, exist_ok=True)
+
+    jobs = []
+    for image_path in list_images(args.images):
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        label_path = os.path.join(args.output, f"{stem}.txt")
+        if os.path.exists(label_path) and not args.overwrite:
+            continue
+        jobs.append((image_path, label_path))
+    print(f"待处理图片 {len(jobs)} 张")
+    if not jobs:
+        return 0
+
+    predictor = load_cli_predictor(args.checkpoint, cli_config_path(args.checkpoint, args.config), args.device)
+
+    failed = 0
+    start = time.perf_counter()
+    for index, (image_path, label_path) in enumerate(jobs, 1):
+        name = os.path.basename(image_path)
+        try:
+            with Image.open(image_path) as image:
+                img_width, img_height = image.size
+
+                def report(done, total):
+                    print(f"\r[{index}/{len(jobs)}] {name}  分块 {done}/{total}", end="", flush=True)
+
+                objects = segment_tiles(predictor, image, args.tile_size, args.overlap, args.points_per_side,
+                                        batch_size=args.tile_batch, score_threshold=args.score_threshold,
+                                        progress=report)
+            lines = []
+            for obj in objects:
+                line = mask_to_yolo_line(obj['mask'], args.class_id, img_width, img_height, dataset_type)
+                if line is not None:
+                    lines.append(line)
+            write_label_file(label_path, lines)
+            print(f"  目标 {len(lines)} 个")
+        except Exception as e:
+            failed += 1
+            print(f"\n处理图片 {name} 时出错: {str(e)}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(f"完成：处理 {len(jobs) - failed} 张，失败 {failed} 张，用时 {elapsed:.1f} 秒")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
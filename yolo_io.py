@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from mask_utils import CompactMask, PolygonMask, as_dense, largest_contour_polygon
+
+# 数据集类型，与界面中的下拉框选项一致
+SEGMENT = "分割"
+DETECT = "检测"
+
+
+def mask_to_yolo_line(mask, class_id, img_width, img_height, dataset_type):
+    """把一个掩码转换为一行YOLO格式标签，无法生成时返回None"""
+    if dataset_type == SEGMENT:
+        # 分割数据集 - 保存多边形顶点坐标；矢量标注直接使用其顶点
+        if isinstance(mask, CompactMask):
+            polygon = mask.vectorize()
+        else:
+            polygon = largest_contour_polygon(as_dense(mask).astype(np.uint8))
+        if polygon is None:
+            return None
+
+        # 构建多边形顶点的归一化坐标列表
+        polygon_points = []
+        for x, y in polygon:
+            polygon_points.append(f"{x / img_width:.6f}")
+            polygon_points.append(f"{y / img_height:.6f}")
+
+        # 分割标签格式：类别 顶点坐标列表
+        return f"{class_id} {' '.join(polygon_points)}"
+
+    # 检测数据集 - 只保存边界框；从检测标签加载的框原样写出
+    box = getattr(mask, 'box', None)
+    if box is not None:
+        center_x, center_y, width, height = box
+        return (f"{class_id} {center_x / img_width:.6f} {center_y / img_height:.6f} "
+                f"{width / img_width:.6f} {height / img_height:.6f}")
+
+    if not isinstance(mask, CompactMask):
+        mask = CompactMask.from_dense(mask)
+    if mask.bbox is None:
+        return None
+    x_min, y_min, x_max, y_max = mask.bbox
+    x_max, y_max = x_max - 1, y_max - 1
+
+    # 计算中心坐标和宽高，并归一化到0-1范围
+    center_x = (x_min + x_max) / (2 * img_width)
+    center_y = (y_min + y_max) / (2 * img_height)
+    width = (x_max - x_min) / img_width
+    height = (y_max - y_min) / img_height
+
+    # 检测标签格式：类别 中心x 中心y 宽度 高度
+    return f"{class_id} {center_x:.6f} {center_y:.6f} {width:.6f} {height:.6f}"
+
+
+def write_text_atomic(file_path, text):
+    """先写临时文件再替换，避免中断时留下不完整的标签文件"""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, file_path)
+
+
+def write_label_file(file_path, lines):
+    """写入YOLO标签文件，每个目标一行"""
+    write_text_atomic(file_path, "".join(f"{line}\n" for line in lines))
+
+
+def write_classes_file(file_path, class_names, class_to_id):
+    """写入类别映射文件，每行为：类别ID 类别名称"""
+    write_text_atomic(file_path, "".join(f"{class_to_id[name]} {name}\n" for name in class_names))
+
+
+def image_size(image_path):
+    """只读取图片文件头获取 (宽, 高)，不解码像素"""
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def parse_label_lines(lines, img_width, img_height):
+    """解析YOLO标签行，自动识别检测/分割标签，返回 [(类别ID, 掩码)]
+
+    掩码保存为矢量几何（多边形顶点，检测框另外保存原始框），再次导出时原样写出，只在显示时栅格化。
+    """
+    shape = (img_height, img_width)
+    labels = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 5:  # 至少需要类别索引和坐标信息
+            continue
+        try:
+            class_id = int(parts[0])
+            values = np.array(parts[1:], dtype=np.float64)
+        except ValueError:
+            continue
+
+        if len(values) == 4:
+            # 检测标签：中心x, 中心y, 宽度, 高度，转换为像素坐标
+            center_x, center_y, width, height = values.tolist()
+            x_min = int((center_x - width / 2) * img_width)
+            y_min = int((center_y - height / 2) * img_height)
+            x_max = int((center_x + width / 2) * img_width)
+            y_max = int((center_y + height / 2) * img_height)
+            box = (center_x * img_width, center_y * img_height, width * img_width, height * img_height)
+            labels.append((class_id, PolygonMask.from_box(x_min, y_min, x_max, y_max, shape, box)))
+            continue
+
+        # 分割标签：归一化的多边形顶点，奇数个数值时忽略最后一个
+        coords = values[:len(values) // 2 * 2].reshape(-1, 2)
+        if len(coords) < 3:
+            continue
+        points = coords * (img_width, img_height)
+        labels.append((class_id, PolygonMask(points, shape)))
+    return labels
+
+
+def read_label_file(label_path, image_path):
+    """读取一张图片的YOLO标签，图片只读取文件头获取尺寸"""
+    img_width, img_height = image_size(image_path)
+    with open(label_path, 'r') as f:
+        return parse_label_lines(f.readlines(), img_width, img_height)
+
+
+def match_label_files(label_files, image_paths):
+    """把标签文件与图片配对，返回 [(标签文件名, 图片路径)]
+
+    先按文件名（不含扩展名）匹配；剩余的标签文件和图片再按顺序一一配对。
+    """
+    image_by_stem = {}
+    for image_path in image_paths:
+        image_by_stem.setdefault(os.path.splitext(os.path.basename(image_path))[0], image_path)
+
+    pairs = []
+    matched_images = set()
+    for label_file in label_files:
+        image_path = image_by_stem.get(os.path.splitext(label_file)[0])
+        if image_path is not None and image_path not in matched_images:
+            pairs.append((label_file, image_path))
+            matched_images.add(image_path)
+
+    matched_stems = {os.path.splitext(os.path.basename(path))[0] for path in matched_images}
+    remaining_labels = [f for f in label_files if os.path.splitext(f)[0] not in matched_stems]
+    remaining_images = [path for path in image_paths if path not in matched_images]
+    pairs.extend(zip(remaining_labels, remaining_images))
+    return pairs
+
+
+def load_label_dir(label_dir, pairs, max_workers=None):
+    """在线程池中读取配对好的标签文件，按顺序返回 (图片路径, 标签列表或异常)"""
+    if max_workers is None:
+        max_workers = min(8, os.cpu_count() or 1)
+
+    def load(pair):
+        label_file, image_path = pair
+        try:
+            return image_path, read_label_file(os.path.join(label_dir, label_file), image_path)
+        except Exception as e:
+            return image_path, e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(load, pairs))